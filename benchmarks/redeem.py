@@ -0,0 +1,299 @@
+"""Offline benchmark of the redemption engine against a local mock of the gift code API.
+
+Starts an aiohttp stand-in for /api/player, /api/captcha and /api/gift_code, points a scratch copy
+of the bot (its own config and SQLite database in a temporary directory) at it and redeems a code
+for synthetic rosters, writing throughput, per-player latency and API usage to a JSON file.
+
+    python benchmarks/redeem.py --players 100 1000 10000 --output results.json
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import yaml
+from aiohttp import web
+from PIL import Image, ImageDraw, ImageFilter
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# The OCR fork server only sees the environment, and it runs from the scratch directory.
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))
+
+CAPTCHA_CHARS = string.ascii_letters + string.digits
+
+
+def render_captcha(text: str) -> bytes:
+    """Draw a noisy captcha image similar to the ones served by the real API."""
+    image = Image.new("RGB", (120, 40), (random.randint(200, 255),) * 3)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        draw.line(
+            [(random.randint(0, 120), random.randint(0, 40)), (random.randint(0, 120), random.randint(0, 40))],
+            fill=tuple(random.randint(80, 200) for _ in range(3)),
+        )
+    for index, char in enumerate(text):
+        draw.text((12 + index * 25, random.randint(4, 16)), char, fill=tuple(random.randint(0, 90) for _ in range(3)))
+    image = image.filter(ImageFilter.SMOOTH)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class MockGiftCodeAPI:
+    """Local stand-in for the gift code API with configurable latency, rate limiting and outcomes."""
+
+    def __init__(self, latency: float, rate_limit: float, captcha_error_rate: float, already_claimed_rate: float):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.captcha_error_rate = captcha_error_rate
+        self.already_claimed_rate = already_claimed_rate
+        self.captchas = [
+            "data:image/png;base64," + base64.b64encode(render_captcha("".join(random.choices(CAPTCHA_CHARS, k=4)))).decode()
+            for _ in range(32)
+        ]
+        self.claimed: set[tuple[str, str]] = set()
+        self.calls: Counter = Counter()
+        self.tokens = float(max(1, rate_limit))
+        self.updated = time.monotonic()
+        self.runner: web.AppRunner | None = None
+
+    def reset(self) -> None:
+        """Clear the call counters between runs."""
+        self.calls.clear()
+
+    async def delay(self, endpoint: str) -> bool:
+        """Simulate network latency and count the call, returning False if it is rate limited."""
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if not self.rate_limit:
+            return True
+
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+        self.updated = now
+        if self.tokens < 1:
+            self.calls["rate_limited"] += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    async def player(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if not await self.delay("player"):
+            return web.json_response({"code": 1, "data": [], "err_code": 40004})
+        fid = data["fid"]
+        return web.json_response({
+            "code": 0,
+            "data": {"fid": int(fid), "nickname": f"Player{fid}", "kid": 1, "stove_lv": 30},
+            "msg": "success",
+            "err_code": "",
+        })
+
+    async def captcha(self, request: web.Request) -> web.Response:
+        await request.post()
+        if not await self.delay("captcha"):
+            return web.json_response({"code": 1, "data": [], "msg": "CAPTCHA GET TOO FREQUENT.", "err_code": 40101})
+        return web.json_response({"code": 0, "data": {"img": random.choice(self.captchas)}, "msg": "SUCCESS", "err_code": 0})
+
+    async def gift_code(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if not await self.delay("gift_code"):
+            return web.json_response({"code": 1, "data": [], "msg": "TIMEOUT RETRY.", "err_code": 40004})
+        if random.random() < self.captcha_error_rate:
+            return web.json_response({"code": 1, "data": [], "msg": "CAPTCHA CHECK ERROR.", "err_code": 40103})
+
+        key = (data["fid"], data["cdk"])
+        if key in self.claimed or random.random() < self.already_claimed_rate:
+            self.claimed.add(key)
+            return web.json_response({"code": 1, "data": [], "msg": "RECEIVED.", "err_code": 40008})
+        self.claimed.add(key)
+        return web.json_response({"code": 0, "data": [], "msg": "SUCCESS", "err_code": 20000})
+
+    async def start(self) -> str:
+        """Start serving on a free local port and return the base URL."""
+        app = web.Application()
+        app.router.add_post("/api/player", self.player)
+        app.router.add_post("/api/captcha", self.captcha)
+        app.router.add_post("/api/gift_code", self.gift_code)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class BenchMessage:
+    """Stands in for the Pyrogram message a redemption run reports its progress to."""
+
+    class Chat:
+        id = 0
+
+    chat = Chat()
+    id = 0
+
+    async def reply(self, text: str, **kwargs) -> "BenchMessage":
+        return self
+
+    async def edit_text(self, text: str, **kwargs) -> "BenchMessage":
+        return self
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def write_config(workdir: Path, base_url: str, args: argparse.Namespace) -> None:
+    """Write a config.yml for a scratch copy of the bot that only talks to the mock."""
+    with open(ROOT / "sample_config.yml") as file:
+        config = yaml.safe_load(file)
+
+    config["database"]["schema"] = f"sqlite+aiosqlite:///{workdir / 'benchmark.db'}"
+    config["misc"].update({
+        "api_url": base_url,
+        "rss_url": None,
+        "rss_sources": [],
+        "metrics_port": None,
+        "outbound_interval": 0,
+        "redeem_workers": args.workers,
+        "ocr_workers": args.ocr_workers,
+        "rate_limit": {"rate": args.rate, "burst": args.workers, "min_rate": 1, "max_rate": args.rate * 2},
+    })
+    with open(workdir / "config.yml", "w") as file:
+        yaml.safe_dump(config, file)
+
+
+async def run_roster(size: int, index: int, mock: MockGiftCodeAPI) -> dict:
+    """Redeem one code for a fresh synthetic roster and measure the run."""
+    from bot import api
+    from bot.database.players import add_players
+    from bot.helpers.misc import run_redemption
+
+    code = f"BENCH{index}"
+    players = [str(100_000_000 + index * 1_000_000 + offset) for offset in range(size)]
+    await add_players([(player_id, f"Player{player_id}", random.randint(1, 5)) for player_id in players])
+
+    first_call: dict[str, float] = {}
+    last_call: dict[str, float] = {}
+    outcomes: Counter = Counter()
+    redeem_code = api.redeem_code
+
+    async def timed_redeem_code(code: str, id: str):
+        first_call.setdefault(id, time.perf_counter())
+        result = await redeem_code(code, id)
+        last_call[id] = time.perf_counter()
+        outcomes[result[2]] += 1
+        return result
+
+    mock.reset()
+    api.redeem_code = timed_redeem_code
+    start = time.perf_counter()
+    try:
+        await run_redemption(BenchMessage(), [code], [(player_id, [code]) for player_id in players])
+    finally:
+        api.redeem_code = redeem_code
+    duration = time.perf_counter() - start
+
+    latencies = [last_call[player_id] - first_call[player_id] for player_id in first_call]
+    redeemed = outcomes["successfully claimed"] + outcomes["already claimed"]
+    api_calls = sum(count for endpoint, count in mock.calls.items() if endpoint != "rate_limited")
+    return {
+        "players": size,
+        "duration_s": round(duration, 3),
+        "players_per_s": round(size / duration, 3),
+        "redeemed": redeemed,
+        "latency_p50_s": round(percentile(latencies, 0.50) or 0, 4),
+        "latency_p99_s": round(percentile(latencies, 0.99) or 0, 4),
+        "api_calls": dict(mock.calls),
+        "api_calls_per_redeemed_player": round(api_calls / redeemed, 3) if redeemed else None,
+        "outcomes": dict(outcomes),
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    random.seed(args.seed)
+    mock = MockGiftCodeAPI(args.latency, args.server_rate_limit, args.captcha_error_rate, args.already_claimed_rate)
+    base_url = await mock.start()
+
+    workdir = Path(tempfile.mkdtemp(prefix="wos-bench-"))
+    write_config(workdir, base_url, args)
+    # The bot loads config.yml from the working directory when it is first imported.
+    os.chdir(workdir)
+
+    from bot import api, dispatcher
+    from bot.database import start_db, stop_db
+    from bot.helpers import misc
+
+    misc.RETRY_DELAY = args.retry_delay
+    if args.skip_ocr:
+        async def classify(captcha_bytes: bytes, charset=None) -> str:
+            return "".join(random.choices(CAPTCHA_CHARS, k=4))
+        api.ocr.classify = classify
+
+    await start_db()
+    await api.init_session()
+    dispatcher.start()
+    runs = []
+    try:
+        for index, size in enumerate(args.players):
+            run = await run_roster(size, index, mock)
+            print(
+                f"{size} players: {run['duration_s']}s, {run['players_per_s']} players/s, "
+                f"p50 {run['latency_p50_s']}s, p99 {run['latency_p99_s']}s, "
+                f"{run['api_calls_per_redeemed_player']} API calls per redeemed player"
+            )
+            runs.append(run)
+    finally:
+        await dispatcher.stop()
+        await api.close_session()
+        api.ocr.shutdown()
+        await stop_db()
+        await mock.stop()
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "runs": runs,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the redemption engine against a local mock of the gift code API.")
+    parser.add_argument("--players", type=int, nargs="+", default=[100, 1000, 10000], help="roster sizes to run")
+    parser.add_argument("--output", default=f"redeem-benchmark-{int(time.time())}.json", help="JSON file to write the results to")
+    parser.add_argument("--workers", type=int, default=8, help="misc.redeem_workers of the bot")
+    parser.add_argument("--ocr-workers", type=int, default=2, help="misc.ocr_workers of the bot")
+    parser.add_argument("--skip-ocr", action="store_true", help="answer captchas with random text instead of running the OCR")
+    parser.add_argument("--rate", type=float, default=50, help="starting redemptions per second of the bot's rate limiter")
+    parser.add_argument("--retry-delay", type=float, default=1, help="seconds a failed player waits before being retried")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean mock API latency in seconds")
+    parser.add_argument("--server-rate-limit", type=float, default=0, help="requests per second the mock accepts before rate limiting (0 disables)")
+    parser.add_argument("--captcha-error-rate", type=float, default=0.2, help="share of gift code calls answered with 40103")
+    parser.add_argument("--already-claimed-rate", type=float, default=0.1, help="share of players answered with 40008")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = Path(args.output).resolve()
+    results = asyncio.run(main(args))
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
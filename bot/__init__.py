@@ -1,10 +1,17 @@
 import logging
 import sys
+import time
 from typing import Final, List
 
 from bot.helpers.api import API
+from bot.helpers.dispatcher import Dispatcher
+from bot.helpers.metrics import Metrics, metrics
+from bot.helpers.rate_limiter import AdaptiveRateLimiter
 from bot.helpers.yaml import load_config
 
+# Reference point for the startup timings logged by __main__
+BOOT_TIME: Final[float] = time.perf_counter()
+
 # Initialize Logger
 logger = logging.getLogger("[WoS-Bot]")
 logging.basicConfig(
@@ -36,12 +43,65 @@ LOG_CHANNEL: Final[int] = telegram_config.get("log_channel")
 
 # Database Constants
 SCHEMA: Final[str] = database_config.get("schema")
+DB_POOL_SIZE: Final[int] = database_config.get("pool_size", 5)
+DB_MAX_OVERFLOW: Final[int] = database_config.get("max_overflow", 10)
+DB_POOL_TIMEOUT: Final[int] = database_config.get("pool_timeout", 30)
+DB_BUSY_TIMEOUT: Final[int] = database_config.get("busy_timeout", 5000)
+DB_CACHE_SIZE: Final[int] = database_config.get("cache_size", -16000)
 
 # Misc Constants
 AUTO_RENAME_USERS: Final[str] = misc_config.get("auto_rename_users")
 RSS_URL: Final[str] = misc_config.get("rss_url")
+RSS_SOURCES: Final[List[dict]] = misc_config.get("rss_sources") or ([{"url": RSS_URL}] if RSS_URL else [])
 RSS_INTERVAL: Final[int] = misc_config.get("rss_interval")
+REDEEM_WORKERS: Final[int] = misc_config.get("redeem_workers", 1)
+EXTERNAL_WORKERS: Final[bool] = misc_config.get("external_workers", False)
+AUTO_REDEEM_MIN_RANK: Final[int | None] = misc_config.get("auto_redeem_min_rank")
+RATE_LIMIT: Final[dict] = misc_config.get("rate_limit") or {}
+OCR_WORKERS: Final[int] = misc_config.get("ocr_workers", 1)
+OCR_EXECUTOR: Final[str] = misc_config.get("ocr_executor", "process")
+CAPTCHA_ATTEMPTS: Final[int] = misc_config.get("captcha_attempts", 3)
+CAPTCHA_CHARSET: Final[int | str | None] = misc_config.get("captcha_charset")
+LOGIN_CACHE: Final[dict] = misc_config.get("login_cache") or {}
+HTTP_CONFIG: Final[dict] = misc_config.get("http") or {}
+OUTBOUND_INTERVAL: Final[float] = misc_config.get("outbound_interval", 1.0)
+METRICS_PORT: Final[int | None] = misc_config.get("metrics_port")
+API_URL: Final[str] = misc_config.get("api_url") or "https://wos-giftcode-api.centurygame.com"
+CIRCUIT_BREAKER: Final[dict] = misc_config.get("circuit_breaker") or {}
 
 # Initialize API instance
-api: API = API()
-logger.info("Global API instance initialized")
\ No newline at end of file
+api: API = API(
+    ocr_workers=OCR_WORKERS,
+    ocr_executor=OCR_EXECUTOR,
+    captcha_attempts=CAPTCHA_ATTEMPTS,
+    captcha_charset=CAPTCHA_CHARSET,
+    login_cache_ttl=LOGIN_CACHE.get("ttl", 600),
+    login_cache_size=LOGIN_CACHE.get("size", 2048),
+    http_limit=HTTP_CONFIG.get("limit", 20),
+    http_keepalive=HTTP_CONFIG.get("keepalive", 60),
+    http_dns_ttl=HTTP_CONFIG.get("dns_ttl", 300),
+    base_url=API_URL,
+    timeouts=HTTP_CONFIG.get("timeouts"),
+    breaker_threshold=CIRCUIT_BREAKER.get("threshold", 5),
+    breaker_cooldown=CIRCUIT_BREAKER.get("cooldown", 60),
+)
+logger.info("Global API instance initialized")
+
+# Initialize the shared redemption rate limiter
+rate_limiter: AdaptiveRateLimiter = AdaptiveRateLimiter(**RATE_LIMIT)
+
+# Initialize the outbound Telegram dispatcher
+dispatcher: Dispatcher = Dispatcher(interval=OUTBOUND_INTERVAL)
+
+
+def collect_runtime_metrics(registry: Metrics) -> None:
+    """Refresh the gauges that mirror live state of the shared API and rate limiter."""
+    registry.set("rate_limit_per_second", rate_limiter.rate)
+    registry.set("ocr_queue_depth", api.ocr.pending)
+    registry.set("login_cache_entries", len(api.logins))
+    registry.set("api_in_use", int(api.lease.busy))
+    registry.set("api_queue_length", len(api.lease.waiters))
+    registry.set("api_circuit_open", int(api.breaker.is_open))
+
+
+metrics.add_collector(collect_runtime_metrics)
@@ -1,10 +1,13 @@
 import asyncio
+import time
 
 from pyrogram.client import Client
 
-from bot import API_HASH, API_ID, BOT_TOKEN, logger
-from bot.database import start_db
+from bot import (API_HASH, API_ID, BOOT_TIME, BOT_TOKEN, METRICS_PORT, api,
+                 dispatcher, logger, metrics)
+from bot.database import start_db, stop_db
 from bot.modules.gift_code import periodic_gift_code_check
+from bot.modules.redeem import resume_redemption_jobs
 
 app = Client(
     "WoS-Bot",
@@ -14,12 +17,56 @@ app = Client(
     plugins=dict(root="bot/modules"),
 )
 
+metrics_runner = None
+warmup_task = None
+startup_phases: list[tuple[str, float]] = []
+phase_start = BOOT_TIME
+
+
+def end_phase(name: str) -> None:
+    """Record how long the current startup phase took and start timing the next one."""
+    global phase_start
+    now = time.perf_counter()
+    startup_phases.append((name, now - phase_start))
+    metrics.set("startup_phase_seconds", now - phase_start, phase=name)
+    phase_start = now
+
+
+async def warm_up():
+    """Load the OCR models in the background so the first redemption does not pay for it."""
+    start = time.perf_counter()
+    try:
+        await api.ocr.warmup()
+    except Exception as e:
+        logger.error(f"OCR warmup failed, retrying on first use: {str(e)}")
+        return
+    metrics.set("startup_phase_seconds", time.perf_counter() - start, phase="ocr_warmup")
+    logger.info(f"OCR warmup finished in {time.perf_counter() - start:.2f}s ({api.ocr.workers} workers)")
+
+async def run_background_jobs():
+    """Resume interrupted redemption jobs, then run the periodic gift code check."""
+    await resume_redemption_jobs(app)
+    await periodic_gift_code_check(app)
+
 async def start_client():
     """Start the Pyrogram client and schedule the periodic gift code check."""
+    global metrics_runner, warmup_task
     await app.start()
+    end_phase("telegram")
+    await api.init_session()
+    logger.info("Shared HTTP session opened.")
+    dispatcher.start()
+    logger.info("Outbound message dispatcher started.")
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_server(METRICS_PORT)
+    end_phase("services")
+    # Heavy resources load after the client is up, so commands are answered right away.
+    warmup_task = asyncio.create_task(warm_up())
     logger.info("Pyrogram Client is ready. Starting periodic gift code check...")
-    task = asyncio.create_task(periodic_gift_code_check(app))
+    task = asyncio.create_task(run_background_jobs())
     logger.info("Periodic gift code check scheduled.")
+    phases = ", ".join(f"{name} {duration:.2f}s" for name, duration in startup_phases)
+    logger.info(f"Startup took {time.perf_counter() - BOOT_TIME:.2f}s ({phases})")
     return task
 
 async def stop_client(task: asyncio.Task):
@@ -29,14 +76,29 @@ async def stop_client(task: asyncio.Task):
         await task
     except asyncio.CancelledError:
         logger.info("Periodic gift code check task canceled.")
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await dispatcher.stop()
+    logger.info("Outbound message dispatcher stopped.")
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        logger.info("Metrics endpoint stopped.")
     await app.stop()
     logger.info("Pyrogram Client stopped.")
+    await api.close_session()
+    logger.info("Shared HTTP session closed.")
+    api.ocr.shutdown()
+    logger.info("OCR workers stopped.")
+    await stop_db()
+    logger.info("Database connections closed.")
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     task = None
     try:
+        end_phase("imports")
         loop.run_until_complete(start_db())
+        end_phase("database")
         task = loop.run_until_complete(start_client())
         loop.run_forever()
     except KeyboardInterrupt:
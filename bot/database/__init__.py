@@ -1,25 +1,104 @@
 import pkgutil
+import time
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import event, inspect, text
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
 from sqlalchemy.orm import declarative_base
 
-from bot import SCHEMA, logger
+from bot import (DB_BUSY_TIMEOUT, DB_CACHE_SIZE, DB_MAX_OVERFLOW,
+                 DB_POOL_SIZE, DB_POOL_TIMEOUT, SCHEMA, logger)
+from bot.helpers.metrics import metrics
 
 BASE = declarative_base()
 
+_engine: AsyncEngine | None = None
+_session_factory: async_sessionmaker | None = None
+
+
+def _set_sqlite_pragmas(dbapi_connection, _) -> None:
+    """Tune every new SQLite connection for concurrent readers and writers."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size={int(DB_CACHE_SIZE)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT)}")
+    cursor.close()
+
+
+def _start_query_timer(connection, cursor, statement, parameters, context, executemany) -> None:
+    connection.info["query_start"] = time.perf_counter()
+
+
+def _record_query_time(connection, cursor, statement, parameters, context, executemany) -> None:
+    """Record the latency of every statement run by the database helpers, labelled by its verb."""
+    start = connection.info.pop("query_start", None)
+    if start is None:
+        return
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "unknown"
+    metrics.observe("db_query_seconds", time.perf_counter() - start, statement=verb)
+
+
+def get_engine() -> AsyncEngine:
+    """Return the engine shared by every database helper, creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            SCHEMA,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        event.listen(_engine.sync_engine, "before_cursor_execute", _start_query_timer)
+        event.listen(_engine.sync_engine, "after_cursor_execute", _record_query_time)
+    return _engine
+
+
+def async_session() -> AsyncSession:
+    """Open a new session on the shared engine."""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(
+            bind=get_engine(), autoflush=True, expire_on_commit=False
+        )
+    return _session_factory()
+
+
+def _migrate_tables(connection) -> None:
+    """Add columns and indexes introduced after a table was first created, as create_all only creates missing tables."""
+    inspector = inspect(connection)
+    for table in BASE.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info(f"[ORM] Adding column {column.name} to {table.name}...")
+                column_type = column.type.compile(connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f"[ORM] Creating index {index.name} on {table.name}...")
+                index.create(connection)
+
 
 async def start_db() -> None:
-    engine = create_async_engine(SCHEMA)
+    engine = get_engine()
     logger.info("[ORM] Connecting to database...")
-    async_session = async_sessionmaker(
-        bind=engine, autoflush=True, expire_on_commit=False
-    )
-
-    async with async_session() as session:
-        async with session.begin():
-            logger.info("[ORM] Creating tables inside database now...")
-            async with engine.begin() as conn:
-                for _, name, _ in pkgutil.iter_modules(["bot/database"]):
-                    __import__(f"bot.database.{name}", fromlist=[""])
-                await conn.run_sync(BASE.metadata.create_all)
-            logger.info("[ORM] Connection successful, session started.")
+
+    async with engine.begin() as conn:
+        logger.info("[ORM] Creating tables inside database now...")
+        for _, name, _ in pkgutil.iter_modules(["bot/database"]):
+            __import__(f"bot.database.{name}", fromlist=[""])
+        await conn.run_sync(BASE.metadata.create_all)
+        await conn.run_sync(_migrate_tables)
+    logger.info("[ORM] Connection successful, session started.")
+
+
+async def stop_db() -> None:
+    """Dispose of the shared engine and close its pooled connections."""
+    if _engine is not None:
+        await _engine.dispose()
@@ -0,0 +1,76 @@
+import json
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from bot import logger
+from bot.database import BASE, async_session
+
+
+class FeedState(BASE):
+    __tablename__ = "feed_state"
+
+    url = Column(String, primary_key=True, nullable=False)
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
+    codes = Column(String, nullable=True)
+    last_seen = Column(Integer, nullable=False)
+
+    def __init__(self, url: str, etag: str = None, last_modified: str = None, content_hash: str = None, codes: str = None, last_seen: int = None):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.codes = codes
+        self.last_seen = last_seen or int(time.time())
+
+    def get_codes(self) -> List[Tuple[str, str]]:
+        """Return the (code, pub_date) pairs the feed contained when it was last processed."""
+        return [tuple(code) for code in json.loads(self.codes)] if self.codes else []
+
+    def __repr__(self):
+        return f"<FeedState url={self.url}, etag={self.etag}, last_seen={self.last_seen}>"
+
+
+async def get_feed_state(url: str) -> Optional[FeedState]:
+    """Retrieve the stored HTTP validators and content hash of a feed."""
+    async with async_session() as session:
+        try:
+            return await session.get(FeedState, url)
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve feed state for {url}: {str(e)}")
+            return None
+
+
+async def save_feed_state(url: str, etag: Optional[str], last_modified: Optional[str], content_hash: str, codes: List[Tuple[str, str]]) -> bool:
+    """Store the HTTP validators, content hash and parsed codes of a processed feed."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.merge(
+                    FeedState(
+                        url=url, etag=etag, last_modified=last_modified,
+                        content_hash=content_hash, codes=json.dumps(codes),
+                    )
+                )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to save feed state for {url}: {str(e)}")
+            return False
+
+
+async def touch_feed(url: str) -> bool:
+    """Update only the last_seen timestamp of an unchanged feed."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                result = await session.execute(
+                    update(FeedState).where(FeedState.url == url).values(last_seen=int(time.time()))
+                )
+                return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to update last_seen for feed {url}: {str(e)}")
+            return False
@@ -1,15 +1,23 @@
 import time
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from sqlalchemy import Column, Integer, String, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-from bot import SCHEMA, logger
-from bot.database import BASE
+from bot import logger
+from bot.database import BASE, async_session
 
-engine = create_async_engine(SCHEMA)
-async_session = async_sessionmaker(bind=engine, autoflush=True, expire_on_commit=False)
+# A code is "active" until a run probes it ("probing") with one canary player, then goes back to
+# "active" for the sweep and ends as "done". Whenever the API reports it unusable it ends in the
+# matching terminal state instead. Only codes in SCHEDULABLE_STATES are ever scheduled, so terminal
+# states, including "redeemed" (what "done" was called before codes had a lifecycle), are final.
+SCHEDULABLE_STATES = ("active", "probing")
+DEAD_CODE_STATES = {
+    "gift code does not exist": "invalid",  # 40014
+    "gift code has expired": "expired",  # 40007
+    "gift code has been fully claimed": "exhausted",  # 40005
+}
 
 
 class GiftCode(BASE):
@@ -20,16 +28,20 @@ class GiftCode(BASE):
     status = Column(String, nullable=False)
     last_checked = Column(Integer, nullable=False)
     created_at = Column(Integer, nullable=False)
+    source = Column(String, nullable=True)
+    reason = Column(String, nullable=True)
 
-    def __init__(self, code: str, pub_date: str, status: str = "active", last_checked: int = None, created_at: int = None):
+    def __init__(self, code: str, pub_date: str, status: str = "active", last_checked: int = None, created_at: int = None, source: str = None, reason: str = None):
         self.code = code
         self.pub_date = pub_date
         self.status = status
+        self.source = source
+        self.reason = reason
         self.last_checked = last_checked or int(time.time())
         self.created_at = created_at or int(time.time())
 
     def __repr__(self):
-        return f"<GiftCode code={self.code}, status={self.status}, pub_date={self.pub_date}>"
+        return f"<GiftCode code={self.code}, status={self.status}, pub_date={self.pub_date}, source={self.source}>"
     
 async def insert_gift_code(code: str, pub_date: str) -> bool:
     """Insert a new gift code into the database."""
@@ -48,6 +60,53 @@ async def insert_gift_code(code: str, pub_date: str) -> bool:
             return False
 
 
+async def sync_gift_codes(rss_codes: List[Tuple[str, str, str]], expire: bool = True) -> Optional[Tuple[Set[str], Set[str]]]:
+    """Reconcile the table with the (code, pub_date, source) triples of the feeds in one transaction, returning the new and newly expired codes.
+
+    Codes missing from the feeds are only expired when `expire` is set, i.e. when every feed could be read.
+    Returns None if the sync failed, so the caller can poll the feeds again instead of treating them as seen.
+    """
+    now = int(time.time())
+    feed_codes = {code: (pub_date, source) for code, pub_date, source in rss_codes}
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                result = await session.execute(select(GiftCode.code).where(GiftCode.code.in_(feed_codes)))
+                existing_codes = set(result.scalars().all())
+                new_codes = set(feed_codes) - existing_codes
+
+                if new_codes:
+                    await session.execute(
+                        sqlite_insert(GiftCode).on_conflict_do_nothing(),
+                        [
+                            {
+                                "code": code, "pub_date": feed_codes[code][0], "source": feed_codes[code][1],
+                                "status": "active", "last_checked": now, "created_at": now,
+                            }
+                            for code in new_codes
+                        ],
+                    )
+                if existing_codes:
+                    await session.execute(
+                        update(GiftCode).where(GiftCode.code.in_(existing_codes)).values(last_checked=now)
+                    )
+
+                expired_codes = set()
+                # Codes that already reached a terminal state keep it, and the reason the API gave.
+                stale = (GiftCode.code.not_in(feed_codes), GiftCode.status.in_(SCHEDULABLE_STATES))
+                if expire:
+                    result = await session.execute(select(GiftCode.code).where(*stale))
+                    expired_codes = set(result.scalars().all())
+                if expired_codes:
+                    await session.execute(update(GiftCode).where(*stale).values(status="expired", last_checked=now))
+
+            logger.info(f"Synced gift codes: {len(new_codes)} new, {len(expired_codes)} expired")
+            return new_codes, expired_codes
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to sync gift codes: {str(e)}")
+            return None
+
+
 async def update_gift_code_status(code: str, status: str) -> bool:
     """Update the status of a gift code."""
     async with async_session() as session:
@@ -65,6 +124,45 @@ async def update_gift_code_status(code: str, status: str) -> bool:
             return False
 
 
+async def transition_gift_code(code: str, status: str, reason: Optional[str] = None, from_states: Tuple[str, ...] = SCHEDULABLE_STATES) -> bool:
+    """Move a gift code to a new state, but only from one of `from_states`, so a terminal state is never left."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                result = await session.execute(
+                    update(GiftCode)
+                    .where(GiftCode.code == code, GiftCode.status.in_(from_states))
+                    .values(status=status, reason=reason, last_checked=int(time.time()))
+                )
+            if result.rowcount > 0:
+                logger.info(f"Gift code {code} is now {status}" + (f" ({reason})" if reason else ""))
+                return True
+            return False
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to move gift code {code} to {status}: {str(e)}")
+            return False
+
+
+async def record_dead_gift_code(code: str, reason: str) -> Optional[str]:
+    """Put a code the API reported as unusable in its terminal state, returning that state."""
+    status = DEAD_CODE_STATES.get(reason)
+    if status is None:
+        return None
+    await transition_gift_code(code, status, reason)
+    return status
+
+
+async def get_gift_code_states(codes: List[str]) -> Dict[str, str]:
+    """Retrieve the state of the given gift codes that are in the database."""
+    async with async_session() as session:
+        try:
+            result = await session.execute(select(GiftCode.code, GiftCode.status).where(GiftCode.code.in_(codes)))
+            return dict(result.all())
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve the state of gift codes {', '.join(codes)}: {str(e)}")
+            return {}
+
+
 async def update_gift_code_last_checked(code: str) -> bool:
     """Update the last_checked timestamp for a gift code."""
     async with async_session() as session:
@@ -83,10 +181,12 @@ async def update_gift_code_last_checked(code: str) -> bool:
 
 
 async def get_active_gift_codes() -> List[Tuple[str, str]]:
-    """Retrieve all active gift codes."""
+    """Retrieve all gift codes that still need redeeming, including ones left probing by an interrupted run."""
     async with async_session() as session:
         try:
-            result = await session.execute(select(GiftCode.code, GiftCode.pub_date).where(GiftCode.status == "active"))
+            result = await session.execute(
+                select(GiftCode.code, GiftCode.pub_date).where(GiftCode.status.in_(SCHEDULABLE_STATES))
+            )
             codes = result.all()
             logger.info(f"Retrieved {len(codes)} active gift codes")
             return [(code, pub_date) for code, pub_date in codes]
@@ -0,0 +1,365 @@
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (Column, Float, Integer, String, bindparam, case,
+                        distinct, func, literal_column, or_, select,
+                        tuple_, update)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from bot import logger
+from bot.database import BASE, async_session
+from bot.database.redemptions import FINAL_STATUSES, Redemption
+
+
+class RedemptionJob(BASE):
+    __tablename__ = "redemption_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    codes = Column(String, nullable=False)
+    chat_id = Column(Integer, nullable=True)
+    status = Column(String, nullable=False)
+    created_at = Column(Integer, nullable=False)
+    updated_at = Column(Integer, nullable=False)
+
+    def __init__(self, codes: str, chat_id: int = None, status: str = "running", created_at: int = None, updated_at: int = None):
+        self.codes = codes
+        self.chat_id = chat_id
+        self.status = status
+        self.created_at = created_at or int(time.time())
+        self.updated_at = updated_at or int(time.time())
+
+    def get_codes(self) -> List[str]:
+        """Return the gift codes redeemed by this job."""
+        return json.loads(self.codes)
+
+    def __repr__(self):
+        return f"<RedemptionJob id={self.id}, codes={self.codes}, status={self.status}>"
+
+
+class RedemptionJobItem(BASE):
+    __tablename__ = "redemption_job_items"
+
+    job_id = Column(Integer, primary_key=True, nullable=False)
+    player_id = Column(String, primary_key=True, nullable=False)
+    code = Column(String, primary_key=True, nullable=False)
+    status = Column(String, nullable=False)
+    outcome = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False)
+    updated_at = Column(Integer, nullable=False)
+    not_before = Column(Float, nullable=True)
+    lease_owner = Column(String, nullable=True)
+    lease_expires = Column(Float, nullable=True)
+
+    def __init__(self, job_id: int, player_id: str, code: str, status: str = "pending", outcome: str = None, attempts: int = 0, updated_at: int = None, not_before: float = None, lease_owner: str = None, lease_expires: float = None):
+        self.job_id = job_id
+        self.player_id = player_id
+        self.code = code
+        self.status = status
+        self.outcome = outcome
+        self.attempts = attempts
+        self.updated_at = updated_at or int(time.time())
+        self.not_before = not_before
+        self.lease_owner = lease_owner
+        self.lease_expires = lease_expires
+
+    def __repr__(self):
+        return f"<RedemptionJobItem job_id={self.job_id}, player_id={self.player_id}, code={self.code}, status={self.status}>"
+
+
+async def create_job(codes: List[str], players: List[Tuple[str, List[str]]], chat_id: Optional[int]) -> Optional[int]:
+    """Persist a redemption run of (player_id, codes) work and return its job ID."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                job = RedemptionJob(codes=json.dumps(codes), chat_id=chat_id)
+                session.add(job)
+                await session.flush()
+                session.add_all(
+                    RedemptionJobItem(job_id=job.id, player_id=player_id, code=code)
+                    for player_id, player_codes in players
+                    for code in player_codes
+                )
+            logger.info(f"Created redemption job {job.id} for {len(players)} players")
+            return job.id
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to create redemption job: {str(e)}")
+            return None
+
+
+async def checkpoint_job(job_id: int, outcomes: List[Tuple[str, str, str]], retry_at: Optional[float] = None, max_attempts: Optional[int] = None) -> bool:
+    """Commit a batch of (player_id, code, outcome) results to the job and the redemption ledger in one transaction.
+
+    Releases any lease on the items. Items that are still pending are not claimed again before
+    `retry_at`, and are marked as failed once they have been attempted `max_attempts` times.
+    """
+    if not outcomes:
+        return True
+    now = int(time.time())
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                items = RedemptionJobItem.__table__
+                status = bindparam("b_status")
+                if max_attempts is not None:
+                    status = case(
+                        ((bindparam("b_status") == "pending") & (items.c.attempts + 1 >= max_attempts), "failed"),
+                        else_=bindparam("b_status"),
+                    )
+                await session.execute(
+                    update(items)
+                    .where(
+                        items.c.job_id == job_id,
+                        items.c.player_id == bindparam("b_player_id"),
+                        items.c.code == bindparam("b_code"),
+                        # Items skipped for a dead code in the meantime must not be queued again.
+                        items.c.status == "pending",
+                    )
+                    .values(
+                        status=status,
+                        outcome=bindparam("b_outcome"),
+                        attempts=items.c.attempts + 1,
+                        updated_at=now,
+                        not_before=retry_at,
+                        lease_owner=None,
+                        lease_expires=None,
+                    ),
+                    [
+                        {
+                            "b_player_id": player_id, "b_code": code, "b_outcome": outcome,
+                            "b_status": "done" if outcome in FINAL_STATUSES else "pending",
+                        }
+                        for player_id, code, outcome in outcomes
+                    ],
+                )
+
+                final = [
+                    {"player_id": player_id, "code": code, "status": outcome, "updated_at": now}
+                    for player_id, code, outcome in outcomes
+                    if outcome in FINAL_STATUSES
+                ]
+                if final:
+                    statement = sqlite_insert(Redemption)
+                    await session.execute(
+                        statement.on_conflict_do_update(
+                            index_elements=[Redemption.player_id, Redemption.code],
+                            set_={"status": statement.excluded.status, "updated_at": statement.excluded.updated_at},
+                        ),
+                        final,
+                    )
+
+                await session.execute(
+                    update(RedemptionJob).where(RedemptionJob.id == job_id).values(updated_at=now)
+                )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to checkpoint redemption job {job_id}: {str(e)}")
+            return False
+
+
+async def skip_job_code(job_id: int, code: str, reason: Optional[str] = None) -> bool:
+    """Mark all outstanding work for a code that can no longer be redeemed as skipped."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.execute(
+                    update(RedemptionJobItem)
+                    .where(
+                        RedemptionJobItem.job_id == job_id,
+                        RedemptionJobItem.code == code,
+                        RedemptionJobItem.status == "pending",
+                    )
+                    .values(status="skipped", outcome=reason, updated_at=int(time.time()), lease_owner=None, lease_expires=None)
+                )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to skip {code} in redemption job {job_id}: {str(e)}")
+            return False
+
+
+async def finish_job(job_id: int, status: str = "done") -> bool:
+    """Mark a redemption job as finished."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.execute(
+                    update(RedemptionJob)
+                    .where(RedemptionJob.id == job_id)
+                    .values(status=status, updated_at=int(time.time()))
+                )
+            logger.info(f"Redemption job {job_id} finished with status: {status}")
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to finish redemption job {job_id}: {str(e)}")
+            return False
+
+
+async def list_running_jobs() -> List[RedemptionJob]:
+    """Retrieve all redemption jobs that have not finished."""
+    async with async_session() as session:
+        try:
+            result = await session.execute(
+                select(RedemptionJob).where(RedemptionJob.status == "running").order_by(RedemptionJob.id)
+            )
+            return result.scalars().all()
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve running redemption jobs: {str(e)}")
+            return []
+
+
+async def get_job_outstanding(job_id: int) -> List[Tuple[str, List[str]]]:
+    """Retrieve the work still pending in a job, returning a list of (player_id, codes)."""
+    async with async_session() as session:
+        try:
+            result = await session.execute(
+                select(RedemptionJobItem.player_id, RedemptionJobItem.code).where(
+                    RedemptionJobItem.job_id == job_id, RedemptionJobItem.status == "pending"
+                )
+            )
+            outstanding: Dict[str, List[str]] = {}
+            for player_id, code in result.all():
+                outstanding.setdefault(player_id, []).append(code)
+            return list(outstanding.items())
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve outstanding work of redemption job {job_id}: {str(e)}")
+            return []
+
+
+async def get_job_counters(job_id: int) -> Dict[str, Dict[str, int]]:
+    """Count the recorded outcomes of a job per code, returning {code: {outcome: count}}."""
+    async with async_session() as session:
+        try:
+            result = await session.execute(
+                select(RedemptionJobItem.code, RedemptionJobItem.status, RedemptionJobItem.outcome, func.count())
+                .where(RedemptionJobItem.job_id == job_id)
+                .group_by(RedemptionJobItem.code, RedemptionJobItem.status, RedemptionJobItem.outcome)
+            )
+            counters: Dict[str, Dict[str, int]] = {}
+            for code, status, outcome, count in result.all():
+                code_counters = counters.setdefault(code, {})
+                key = outcome if status == "done" else status
+                code_counters[key] = code_counters.get(key, 0) + count
+            return counters
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to count outcomes of redemption job {job_id}: {str(e)}")
+            return {}
+
+
+async def claim_job_items(owner: str, players: int, lease: float) -> List[Tuple[int, str, List[str]]]:
+    """Lease the pending work of up to `players` players of running jobs, returning a list of (job_id, player_id, codes).
+
+    Items leased by another worker are only taken over once the lease has expired, so work held by a
+    crashed worker is picked up again.
+    """
+    now = time.time()
+    expires = now + lease
+    items = RedemptionJobItem
+    claimable = (
+        items.status == "pending",
+        or_(items.lease_expires.is_(None), items.lease_expires < now),
+        or_(items.not_before.is_(None), items.not_before <= now),
+        items.job_id.in_(select(RedemptionJob.id).where(RedemptionJob.status == "running")),
+    )
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                # One UPDATE picks and leases the players, so concurrent workers can never claim the same one.
+                await session.execute(
+                    update(items)
+                    .where(
+                        *claimable,
+                        tuple_(items.job_id, items.player_id).in_(
+                            select(items.job_id, items.player_id)
+                            .where(*claimable)
+                            .group_by(items.job_id, items.player_id)
+                            # Due retries first, then untried players in the order the job listed them (highest rank first).
+                            .order_by(
+                                items.job_id,
+                                func.min(func.coalesce(items.not_before, now)),
+                                func.min(literal_column("rowid")),
+                            )
+                            .limit(players)
+                        ),
+                    )
+                    .values(lease_owner=owner, lease_expires=expires)
+                )
+                result = await session.execute(
+                    select(items.job_id, items.player_id, items.code).where(
+                        items.lease_owner == owner, items.lease_expires == expires, items.status == "pending"
+                    )
+                )
+            claimed: Dict[Tuple[int, str], List[str]] = {}
+            for job_id, player_id, code in result.all():
+                claimed.setdefault((job_id, player_id), []).append(code)
+            return [(job_id, player_id, codes) for (job_id, player_id), codes in claimed.items()]
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to claim redemption work for {owner}: {str(e)}")
+            return []
+
+
+async def extend_leases(owners: List[str], lease: float) -> bool:
+    """Renew the leases workers hold on work they are still processing."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.execute(
+                    update(RedemptionJobItem)
+                    .where(RedemptionJobItem.lease_owner.in_(owners), RedemptionJobItem.status == "pending")
+                    .values(lease_expires=time.time() + lease)
+                )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to renew the leases of {', '.join(owners)}: {str(e)}")
+            return False
+
+
+async def release_leases(owners: List[str]) -> bool:
+    """Give back the work stopping workers still hold so others can pick it up right away."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.execute(
+                    update(RedemptionJobItem)
+                    .where(RedemptionJobItem.lease_owner.in_(owners))
+                    .values(lease_owner=None, lease_expires=None)
+                )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to release the leases of {', '.join(owners)}: {str(e)}")
+            return False
+
+
+async def get_job_progress(job_id: int) -> Dict:
+    """Summarize a job for progress reports: its status, player counts, retries, players currently claimed by a worker and the codes that were stopped."""
+    items = RedemptionJobItem
+    async with async_session() as session:
+        try:
+            job = await session.get(RedemptionJob, job_id)
+            result = await session.execute(
+                select(
+                    func.count(distinct(items.player_id)),
+                    func.count(distinct(case((items.status == "pending", items.player_id)))),
+                    func.count(distinct(case((items.status == "failed", items.player_id)))),
+                    func.coalesce(func.sum(case((items.attempts > 1, items.attempts - 1), else_=0)), 0),
+                    func.count(distinct(case((items.lease_expires > time.time(), items.player_id)))),
+                ).where(items.job_id == job_id)
+            )
+            players, pending, failed, retries, leased = result.one()
+            result = await session.execute(
+                select(items.code, items.outcome)
+                .where(items.job_id == job_id, items.status == "skipped", items.outcome.is_not(None))
+                .distinct()
+            )
+            return {
+                "status": job.status if job else None,
+                "players": players,
+                "pending_players": pending,
+                "failed_players": failed,
+                "retries": retries,
+                "leased_players": leased,
+                "dead_codes": dict(result.all()),
+            }
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to summarize redemption job {job_id}: {str(e)}")
+            return {}
@@ -1,15 +1,11 @@
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import Column, Integer, String, select
+from sqlalchemy import (Column, Index, Integer, String, and_, func, or_, select,
+                        update)
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from sqlalchemy.orm import declarative_base
 
-from bot import SCHEMA, logger
-from bot.database import BASE
-
-engine = create_async_engine(SCHEMA)
-async_session = async_sessionmaker(bind=engine, autoflush=True, expire_on_commit=False)
+from bot import logger
+from bot.database import BASE, async_session
 
 
 class Player(BASE):
@@ -19,6 +15,8 @@ class Player(BASE):
     name = Column(String, nullable=True)
     rank = Column(Integer, nullable=True)
 
+    __table_args__ = (Index("ix_players_rank_name", rank.desc(), name),)
+
     def __init__(self, player_id: str, name: str = None, rank: int = None):
         self.player_id = player_id
         self.name = name
@@ -48,6 +46,30 @@ async def add_player(player_id: str, name: str, rank: int) -> bool:
         return False
 
 
+async def add_players(players: List[Tuple[str, str, int]]) -> int:
+    """Add many (player_id, name, rank) players in a single transaction, skipping existing IDs, and return how many were added."""
+    if not players:
+        return 0
+    try:
+        async with async_session() as session:
+            existing = await session.execute(
+                select(Player.player_id).where(Player.player_id.in_([player[0] for player in players]))
+            )
+            existing_ids = set(existing.scalars().all())
+            new_players = {
+                player_id: Player(player_id=player_id, name=name, rank=rank)
+                for player_id, name, rank in players
+                if player_id not in existing_ids
+            }
+            session.add_all(new_players.values())
+            await session.commit()
+            return len(new_players)
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to add {len(players)} players: {str(e)}")
+        await session.rollback()
+        return 0
+
+
 async def remove_player(player_id: str) -> Optional[str]:
     """Remove a player from the database and return their name if found."""
     try:
@@ -82,6 +104,69 @@ async def list_players() -> List[Tuple[str, str, int]]:
         return []
 
 
+async def list_players_by_rank(min_rank: Optional[int] = None) -> List[Tuple[str, int]]:
+    """Retrieve players ordered by rank (highest first), optionally only those of at least `min_rank`, returning a list of (player_id, rank)."""
+    # Served by ix_players_rank_name, so the order comes from the index instead of a sort.
+    query = select(Player.player_id, Player.rank).order_by(Player.rank.desc(), Player.name)
+    if min_rank is not None:
+        query = query.where(Player.rank >= min_rank)
+    try:
+        async with async_session() as session:
+            result = await session.execute(query)
+            return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Error retrieving players by rank: {str(e)}")
+        return []
+
+
+async def count_players() -> int:
+    """Count the players in the database."""
+    try:
+        async with async_session() as session:
+            result = await session.execute(select(func.count()).select_from(Player))
+            return result.scalar_one()
+    except SQLAlchemyError as e:
+        logger.error(f"Error counting players: {str(e)}")
+        return 0
+
+
+async def list_players_page(
+    after: Optional[Tuple[int, str, str]] = None,
+    before: Optional[Tuple[int, str, str]] = None,
+    limit: int = 10,
+) -> List[Tuple[str, str, int]]:
+    """Retrieve one page of players ordered by rank (highest first) and name, returning a list of (player_id, name, rank).
+
+    Pages are addressed by the (rank, name, player_id) key of the last row of the previous page (`after`)
+    or of the first row of the next page (`before`), so every page costs the same regardless of roster size.
+    """
+    name = func.coalesce(Player.name, "")
+    query = select(Player.player_id, Player.name, Player.rank).where(Player.rank.is_not(None))
+    if after is not None:
+        rank, last_name, player_id = after
+        query = query.where(or_(
+            Player.rank < rank,
+            and_(Player.rank == rank, or_(name > (last_name or ""), and_(name == (last_name or ""), Player.player_id > player_id))),
+        )).order_by(Player.rank.desc(), Player.name, Player.player_id)
+    elif before is not None:
+        rank, first_name, player_id = before
+        query = query.where(or_(
+            Player.rank > rank,
+            and_(Player.rank == rank, or_(name < (first_name or ""), and_(name == (first_name or ""), Player.player_id < player_id))),
+        )).order_by(Player.rank, Player.name.desc(), Player.player_id.desc())
+    else:
+        query = query.order_by(Player.rank.desc(), Player.name, Player.player_id)
+
+    try:
+        async with async_session() as session:
+            result = await session.execute(query.limit(limit))
+            rows = result.all()
+            return rows[::-1] if before is not None else rows
+    except SQLAlchemyError as e:
+        logger.error(f"Error retrieving players page: {str(e)}")
+        return []
+
+
 async def set_rank(player_id: str, rank: int) -> Optional[str]:
     """Update a player's rank and return their name if found."""
     try:
@@ -137,4 +222,33 @@ async def get_local_name(player_id: str) -> Optional[str]:
             return player.name if player else None
     except SQLAlchemyError as e:
         logger.error(f"Error retrieving name for {player_id}: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+
+async def get_local_names() -> Dict[str, Optional[str]]:
+    """Retrieve the names of all players, returning a mapping of player_id to name."""
+    try:
+        async with async_session() as session:
+            result = await session.execute(select(Player.player_id, Player.name))
+            return {player_id: name for player_id, name in result.all()}
+    except SQLAlchemyError as e:
+        logger.error(f"Error retrieving player names: {str(e)}")
+        return {}
+
+
+async def bulk_edit_local_names(names: Dict[str, str]) -> bool:
+    """Update the names of many existing players in a single transaction."""
+    if not names:
+        return True
+    try:
+        async with async_session() as session:
+            await session.execute(
+                update(Player),
+                [{"player_id": player_id, "name": name} for player_id, name in names.items()],
+            )
+            await session.commit()
+            return True
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to update names for {len(names)} players: {str(e)}")
+        await session.rollback()
+        return False
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from sqlalchemy import Column, Float, String, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from bot import logger
+from bot.database import BASE, async_session
+
+
+class RateBudget(BASE):
+    __tablename__ = "rate_budget"
+
+    name = Column(String, primary_key=True, nullable=False)
+    rate = Column(Float, nullable=False)
+    tokens = Column(Float, nullable=False)
+    updated = Column(Float, nullable=False)
+
+    def __init__(self, name: str, rate: float, tokens: float, updated: float = None):
+        self.name = name
+        self.rate = rate
+        self.tokens = tokens
+        self.updated = updated or time.time()
+
+    def __repr__(self):
+        return f"<RateBudget name={self.name}, rate={self.rate}, tokens={self.tokens}>"
+
+
+class SharedRateLimiter:
+    """Token bucket stored in the database, so every worker process draws from one budget.
+
+    Tuned AIMD-style from API feedback like AdaptiveRateLimiter, with the rate shared as well.
+    """
+
+    def __init__(
+        self,
+        name: str = "api",
+        rate: float = 0.33,
+        burst: int = 1,
+        min_rate: float = 0.05,
+        max_rate: float = 2.0,
+        increase: float = 0.02,
+        decrease: float = 0.5,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+    async def init(self) -> None:
+        """Create the shared bucket unless another worker already did."""
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    await session.execute(
+                        sqlite_insert(RateBudget)
+                        .values(name=self.name, rate=self.rate, tokens=float(self.burst), updated=time.time())
+                        .on_conflict_do_nothing(index_elements=[RateBudget.name])
+                    )
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to create rate budget {self.name}: {str(e)}")
+
+    async def acquire(self) -> None:
+        """Wait until a token is available in the shared bucket and consume it."""
+        while True:
+            now = time.time()
+            refilled = func.min(self.burst, RateBudget.tokens + (now - RateBudget.updated) * RateBudget.rate)
+            async with async_session() as session:
+                try:
+                    async with session.begin():
+                        # Refilling and taking a token in one UPDATE keeps concurrent workers from overspending.
+                        result = await session.execute(
+                            update(RateBudget)
+                            .where(RateBudget.name == self.name, refilled >= 1)
+                            .values(tokens=refilled - 1, updated=now)
+                        )
+                    if result.rowcount:
+                        return
+                    result = await session.execute(
+                        select(refilled, RateBudget.rate).where(RateBudget.name == self.name)
+                    )
+                    tokens, self.rate = result.one()
+                    wait = (1 - tokens) / self.rate
+                except SQLAlchemyError as e:
+                    logger.error(f"Failed to take a token from rate budget {self.name}: {str(e)}")
+                    wait = 1 / self.rate
+            await asyncio.sleep(max(wait, 0.01))
+
+    async def _adjust(self, rate) -> None:
+        async with async_session() as session:
+            try:
+                async with session.begin():
+                    await session.execute(update(RateBudget).where(RateBudget.name == self.name).values(rate=rate))
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to adjust rate budget {self.name}: {str(e)}")
+
+    async def on_success(self) -> None:
+        """Additively raise the shared rate after an accepted request."""
+        await self._adjust(func.min(self.max_rate, RateBudget.rate + self.increase))
+
+    async def on_backoff(self) -> None:
+        """Multiplicatively lower the shared rate after being rate limited."""
+        await self._adjust(func.max(self.min_rate, RateBudget.rate * self.decrease))
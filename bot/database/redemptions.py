@@ -0,0 +1,67 @@
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from bot import logger
+from bot.database import BASE, async_session
+from bot.database.players import list_players_by_rank
+
+# Outcomes after which a (player, code) pair never needs to be sent to the API again.
+FINAL_STATUSES = ("already_claimed", "successfully_claimed")
+
+
+class Redemption(BASE):
+    __tablename__ = "redemptions"
+
+    player_id = Column(String, primary_key=True, nullable=False)
+    code = Column(String, primary_key=True, nullable=False)
+    status = Column(String, nullable=False)
+    updated_at = Column(Integer, nullable=False)
+
+    def __init__(self, player_id: str, code: str, status: str, updated_at: int = None):
+        self.player_id = player_id
+        self.code = code
+        self.status = status
+        self.updated_at = updated_at or int(time.time())
+
+    def __repr__(self):
+        return f"<Redemption player_id={self.player_id}, code={self.code}, status={self.status}>"
+
+
+async def record_redemption(player_id: str, code: str, status: str) -> bool:
+    """Record the outcome of redeeming a gift code for a player."""
+    async with async_session() as session:
+        try:
+            async with session.begin():
+                await session.merge(Redemption(player_id=player_id, code=code, status=status))
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to record redemption of {code} for {player_id}: {str(e)}")
+            return False
+
+
+async def list_outstanding_redemptions(codes: List[str], min_rank: Optional[int] = None) -> List[Tuple[str, List[str]]]:
+    """Retrieve the players that still need any of the given gift codes, highest rank first, returning a list of (player_id, codes).
+
+    With `min_rank`, only players of at least that rank are considered.
+    """
+    players = await list_players_by_rank(min_rank)
+    async with async_session() as session:
+        try:
+            done = await session.execute(
+                select(Redemption.player_id, Redemption.code).where(
+                    Redemption.code.in_(codes), Redemption.status.in_(FINAL_STATUSES)
+                )
+            )
+            done_pairs = set(done.all())
+            outstanding = []
+            for player_id, _ in players:
+                player_codes = [code for code in codes if (player_id, code) not in done_pairs]
+                if player_codes:
+                    outstanding.append((player_id, player_codes))
+            return outstanding
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve outstanding players for {', '.join(codes)}: {str(e)}")
+            return []
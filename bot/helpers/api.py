@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import ssl
@@ -5,48 +6,145 @@ import time
 
 import aiohttp
 import certifi
-import ddddocr
+
+from bot.helpers.cache import TTLCache
+from bot.helpers.circuit import CircuitBreaker
+from bot.helpers.lease import LeaseManager
+from bot.helpers.metrics import metrics
+from bot.helpers.ocr import OCRExecutor
+
+# Connect and read timeouts in seconds per endpoint. The whole call is bounded by their sum, so a
+# stalled API costs seconds per request instead of the old flat 30.
+ENDPOINT_TIMEOUTS = {
+    "player": {"connect": 5, "read": 10},
+    "captcha": {"connect": 5, "read": 10},
+    "gift_code": {"connect": 5, "read": 15},
+}
 
 
 class API:
-    def __init__(self):
-        self.inUse = False
-        self.lastUsed = 0
+    def __init__(
+        self,
+        ocr_workers: int = 1,
+        ocr_executor: str = "process",
+        captcha_attempts: int = 3,
+        captcha_charset: int | str | None = None,
+        login_cache_ttl: float = 600,
+        login_cache_size: int = 2048,
+        http_limit: int = 20,
+        http_keepalive: float = 60,
+        http_dns_ttl: int = 300,
+        base_url: str = "https://wos-giftcode-api.centurygame.com",
+        lease_cooldown: float = 60,
+        timeouts: dict | None = None,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60,
+    ):
+        self.base_url = base_url.rstrip("/")
+        # Redemption runs take turns on the API through this, with a cooldown between them.
+        self.lease = LeaseManager(cooldown=lease_cooldown)
+        # Pauses every caller while the API is down, instead of each one timing out.
+        self.breaker = CircuitBreaker(threshold=breaker_threshold, cooldown=breaker_cooldown)
+        self.timeouts = {
+            endpoint: aiohttp.ClientTimeout(total=limits["connect"] + limits["read"], connect=limits["connect"], sock_read=limits["read"])
+            for endpoint, defaults in ENDPOINT_TIMEOUTS.items()
+            for limits in [{**defaults, **(timeouts or {}).get(endpoint, {})}]
+        }
+        self.captcha_attempts = max(1, captcha_attempts)
+        self.captcha_charset = captcha_charset
         
         self.headers = {
             "Content-Type": "application/x-www-form-urlencoded",
             "Accept": "application/json",
         }
         
-        self.ocr = ddddocr.DdddOcr(show_ad=False)
+        self.ocr = OCRExecutor(workers=ocr_workers, mode=ocr_executor)
         
-    async def init_session(self):
-        self.session = aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(
-                ssl=ssl.create_default_context(cafile=certifi.where())
-            )
-        )
+        self.logins = TTLCache(maxsize=login_cache_size, ttl=login_cache_ttl)
+        self.pending_logins: dict[str, asyncio.Future] = {}
         
+        self.http_limit = http_limit
+        self.http_keepalive = http_keepalive
+        self.http_dns_ttl = http_dns_ttl
+        self.session: aiohttp.ClientSession | None = None
+        self.session_lock = asyncio.Lock()
+        
+    async def init_session(self) -> aiohttp.ClientSession:
+        """Return the shared keep-alive HTTP session, creating it if needed. Callers must not close it."""
+        if self.session is not None and not self.session.closed:
+            return self.session
+        
+        async with self.session_lock:
+            if self.session is None or self.session.closed:
+                self.session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        ssl=ssl.create_default_context(cafile=certifi.where()),
+                        limit=self.http_limit,
+                        keepalive_timeout=self.http_keepalive,
+                        ttl_dns_cache=self.http_dns_ttl,
+                    )
+                )
+            return self.session
+        
+    async def close_session(self):
+        """Close the shared HTTP session and its pooled connections."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        
+    async def _post(self, endpoint: str, data: dict, **kwargs) -> dict | None:
+        """POST to an API endpoint and return its JSON body, or None if the call failed or was not answered with JSON.
+
+        Waits while the circuit breaker is open and reports every outcome to it. Records the latency
+        of every call and the err_code it answered with.
+        """
+        session = await self.init_session()
+        await self.breaker.wait()
+        err_code = "exception"
+        try:
+            with metrics.timer("api_request_seconds", endpoint=endpoint):
+                resp = await session.post(
+                    url=f"{self.base_url}/api/{endpoint}", data=data, timeout=self.timeouts[endpoint], **kwargs
+                )
+                try:
+                    result = await resp.json()
+                except Exception as _:
+                    result = None
+            if isinstance(result, dict):
+                err_code = result.get("err_code", "none")
+            else:
+                err_code = "invalid_json"
+                result = None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            result = None
+        except BaseException:
+            # No answer either way, so if this was the probe another caller may take its place.
+            self.breaker.release()
+            raise
+        finally:
+            metrics.inc("api_responses_total", endpoint=endpoint, err_code=err_code)
+
+        if result is None:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return result
+
     async def login_user(self, id: str) -> tuple[bool, str, str, dict | None]:        
         now = time.time_ns()
         
-        resp = await self.session.post(
-            url="https://wos-giftcode-api.centurygame.com/api/player",
+        result = await self._post(
+            "player",
             data={
                 "fid": id,
                 "time": now,
                 "sign": hashlib.md5(f"fid={id}&time={now}tB87#kPtkxqOS2".encode()).hexdigest()
             },
-            headers=self.headers,
-            timeout=30
+            headers=self.headers
         )
         
-        now = time.time_ns()
-
-        try:
-            result = await resp.json()
-        except Exception as _:
-            return False, "error", "login error"
+        if result is None:
+            # No answer at all, unlike "login error" which is the API rejecting the player.
+            return False, "error", "request failed", None
         
         if "msg" in result:
             if result["msg"] != "success":
@@ -56,11 +154,39 @@ class API:
         else:
             return False, "error", "rate limited", None
         
+    async def cached_login(self, id: str) -> tuple[bool, str, str, dict | None]:
+        """Log in a player, reusing a recent successful login and sharing in-flight ones."""
+        cached = self.logins.get(id)
+        if cached is not None:
+            return cached
+        
+        if id in self.pending_logins:
+            return await asyncio.shield(self.pending_logins[id])
+        
+        future = asyncio.get_running_loop().create_future()
+        self.pending_logins[id] = future
+        try:
+            login = await self.login_user(id)
+            if login[1] == "success":
+                self.logins.set(id, login)
+            future.set_result(login)
+            return login
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting on it.
+            future.exception()
+            raise
+        finally:
+            del self.pending_logins[id]
+        
     async def fetch_captcha(self, id: str) -> tuple[bool, bytes | None]:
         now = time.time_ns()
         
-        captcha = await self.session.post(
-            url="https://wos-giftcode-api.centurygame.com/api/captcha",
+        captcha_json = await self._post(
+            "captcha",
             data={
                 "fid": id,
                 "time": now,
@@ -69,10 +195,8 @@ class API:
             }
         )
         
-        try:
-            captcha_json = await captcha.json()
-        except Exception as _:
-            return True, None
+        if captcha_json is None:
+            return False, None
         
         if captcha_json["err_code"] == 40100:
             return False, None
@@ -82,34 +206,44 @@ class API:
             return False, None
         
     async def redeem_code(self, code: str, id: str) -> tuple[bool, str, str, dict]:
-        exit, counter, message, player_data = await self.login_user(id)
+        exit, counter, message, player_data = await self.cached_login(id)
         
-        if exit:
+        if exit or counter == "error":
             return exit, counter, message, None
         
-        success, captcha_bytes = await self.fetch_captcha(id)
-        
-        if success:
-            predicted_captcha = self.ocr.classification(captcha_bytes)
-        else:
-            return False, "error", "captcha error", None
-        
-        now = time.time_ns()
-        
-        resp = await self.session.post(
-            url="https://wos-giftcode-api.centurygame.com/api/gift_code",
-            data={
-                "cdk": code, "fid": id, "time": now, "captcha_code": predicted_captcha,
-                "sign": hashlib.md5(f"captcha_code={predicted_captcha}&cdk={code}&fid={id}&time={now}tB87#kPtkxqOS2".encode()).hexdigest()
-            },
-            headers=self.headers,
-            timeout=30
-        )
+        # A wrong captcha (40103) is retried right away with a fresh captcha on the same login,
+        # using the restricted charset (if any) after the first miss.
+        for attempt in range(self.captcha_attempts):
+            success, captcha_bytes = await self.fetch_captcha(id)
+            
+            if success:
+                charset = self.captcha_charset if attempt > 0 else None
+                predicted_captcha = await self.ocr.classify(captcha_bytes, charset)
+            else:
+                return False, "error", "captcha fetch error", None
+            
+            now = time.time_ns()
+            
+            result = await self._post(
+                "gift_code",
+                data={
+                    "cdk": code, "fid": id, "time": now, "captcha_code": predicted_captcha,
+                    "sign": hashlib.md5(f"captcha_code={predicted_captcha}&cdk={code}&fid={id}&time={now}tB87#kPtkxqOS2".encode()).hexdigest()
+                },
+                headers=self.headers
+            )
+            
+            if result is None:
+                # Retried like any other failed attempt; an outage is handled by the circuit breaker.
+                return False, "error", "request failed", None
+            
+            if result["err_code"] != 40103:
+                break
         
-        try:
-            result = await resp.json()
-        except Exception as _:
-            return True, "error", "unknown error", None
+        if result["err_code"] == 40009:
+            # The cached login is no longer valid on the server side.
+            self.logins.pop(id)
+            return False, "error", "login expired", None
         
         if result["err_code"] == 40014:
             return True, None, "gift code does not exist", None
@@ -123,5 +257,8 @@ class API:
             return False, "successfully_claimed", "successfully claimed", player_data
         elif result["err_code"] == 40103:
             return False, "error", "captcha error", None
+        elif result["err_code"] == 40004:
+            # The gift code endpoint's own throttle answer.
+            return False, "error", "rate limited", None
         else:
             return False, "error", "unknown error", None
\ No newline at end of file
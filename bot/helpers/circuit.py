@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("[WoS-Bot]")
+
+
+class CircuitBreaker:
+    """Stops calling the API after consecutive failures until a probe request gets through again.
+
+    While open, callers wait in `wait()` instead of spending a timeout each. Once the cooldown ends,
+    a single caller is let through as the probe: if it succeeds the breaker closes and everyone
+    resumes, otherwise it opens again with the cooldown doubled up to `max_cooldown`.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60, max_cooldown: float = 600):
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at: float | None = None
+        self.probing = False
+        self.closed = asyncio.Event()
+        self.closed.set()
+        self.opened = asyncio.Event()
+        # Replaced on every state change, so waiters re-check when the probe finishes.
+        self.changed = asyncio.Event()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != "closed"
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe may be sent."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    async def wait(self) -> None:
+        """Wait until a request may be sent, which is right away while the breaker is closed."""
+        while self.state != "closed":
+            if self.state == "open" and not self.retry_in():
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return
+
+            changed = self.changed
+            delay = self.retry_in() if self.state == "open" else None
+            try:
+                await asyncio.wait_for(changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probing = False
+        if self.state != "closed":
+            logger.info(f"API circuit closed after {time.monotonic() - self.opened_at:.0f}s")
+            self.state = "closed"
+            self.opened_at = None
+            self.cooldown = self.base_cooldown
+            self.opened.clear()
+            self.closed.set()
+            self._notify()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" and self.probing:
+            # The probe failed: stay open and back off further.
+            self.probing = False
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            logger.warning(f"API probe failed, next probe in {self.cooldown:.0f}s")
+            self._notify()
+        elif self.state == "closed" and self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.closed.clear()
+            self.opened.set()
+            logger.warning(f"API circuit opened after {self.failures} consecutive failures, next probe in {self.cooldown:.0f}s")
+            self._notify()
+
+    def release(self) -> None:
+        """Give up the probe slot without an outcome, e.g. when the probe was cancelled."""
+        if self.state == "half_open" and self.probing:
+            self.probing = False
+            self.state = "open"
+            self.opened_at = time.monotonic() - self.cooldown
+            self._notify()
+
+    def _notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+logger = logging.getLogger("[WoS-Bot]")
+
+
+class Dispatcher:
+    """Single outbound queue for progress edits and notifications.
+
+    Edits to the same message are coalesced so only the latest text is sent, every chat is
+    limited to one request per `interval` seconds, and FloodWait errors reschedule the request
+    instead of failing it.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.pending: OrderedDict[Hashable, tuple[int, Callable[[], Awaitable], asyncio.Future | None]] = OrderedDict()
+        self.next_allowed: dict[int, float] = {}
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start delivering queued requests in the background."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop the delivery task, dropping anything still queued."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def edit(self, message, text: str, **kwargs) -> None:
+        """Queue an edit of a message, replacing any edit of it that has not been sent yet."""
+        key = ("edit", message.chat.id, message.id)
+        self.pending[key] = (message.chat.id, lambda: message.edit_text(text, **kwargs), None)
+        self.wakeup.set()
+
+    def send(self, client, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue a new message, returning a future that resolves to the sent message."""
+        return self._enqueue(chat_id, lambda: client.send_message(chat_id, text, **kwargs))
+
+    def reply(self, message, text: str, **kwargs) -> asyncio.Future:
+        """Queue a reply to a message, returning a future that resolves to the sent message."""
+        return self._enqueue(message.chat.id, lambda: message.reply(text, **kwargs))
+
+    def _enqueue(self, chat_id: int, request: Callable[[], Awaitable]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may await a notification, so never warn about an unretrieved exception.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.pending[("send", next(self.sequence))] = (chat_id, request, future)
+        self.wakeup.set()
+        return future
+
+    def _next_ready(self) -> Hashable | None:
+        now = time.monotonic()
+        for key, (chat_id, _, _) in self.pending.items():
+            if self.next_allowed.get(chat_id, 0) <= now:
+                return key
+        return None
+
+    async def run(self) -> None:
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            while self.pending:
+                key = self._next_ready()
+                if key is None:
+                    delay = min(self.next_allowed[chat_id] for chat_id, _, _ in self.pending.values()) - time.monotonic()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), max(0, delay))
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wakeup.clear()
+                    continue
+
+                chat_id, request, future = self.pending.pop(key)
+                try:
+                    result = await request()
+                except FloodWait as e:
+                    logger.warning(f"FloodWait of {e.value}s in chat {chat_id}, rescheduling")
+                    self.next_allowed[chat_id] = time.monotonic() + e.value
+                    # A newer edit of the same message may have been queued meanwhile.
+                    self.pending.setdefault(key, (chat_id, request, future))
+                    continue
+                except MessageNotModified:
+                    result = None
+                except Exception as e:
+                    logger.error(f"Failed to deliver message to chat {chat_id}: {str(e)}")
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                    result = None
+
+                self.next_allowed[chat_id] = time.monotonic() + self.interval
+                if future is not None and not future.done():
+                    future.set_result(result)
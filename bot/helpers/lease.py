@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+
+class Lease:
+    """Exclusive use of the API by one job."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.granted_at = time.monotonic()
+        # Leave the API to the next job without a cooldown if this one never called it.
+        self.used = True
+
+    def __repr__(self):
+        return f"<Lease label={self.label}, used={self.used}>"
+
+
+class LeaseManager:
+    """Hands out exclusive use of the API to one job at a time, in FIFO order.
+
+    The next job is woken exactly when the cooldown after the previous lease ends, so nobody
+    polls and nobody is turned away while the API is busy.
+    """
+
+    def __init__(self, cooldown: float = 60):
+        self.cooldown = cooldown
+        self.current: Lease | None = None
+        self.released_at = float("-inf")
+        self.waiters: deque[tuple[Lease, asyncio.Future]] = deque()
+        self.handoff: asyncio.TimerHandle | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    def queue(self) -> list[str]:
+        """Return the labels of the jobs waiting for the API, first in line first."""
+        return [lease.label for lease, _ in self.waiters]
+
+    def available_in(self) -> float:
+        """Seconds until the cooldown after the last lease ends."""
+        return max(0.0, self.released_at + self.cooldown - time.monotonic())
+
+    @asynccontextmanager
+    async def hold(self, label: str, on_queued: Callable[[int], Awaitable] | None = None) -> AsyncIterator[Lease]:
+        """Wait for exclusive use of the API and keep it until the block exits.
+
+        `on_queued` is awaited with the 1-based queue position if the caller has to wait.
+        """
+        lease = Lease(label)
+        if self.current is None and not self.waiters and not self.available_in():
+            self.current = lease
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append((lease, future))
+            self._schedule_handoff()
+            try:
+                if on_queued is not None:
+                    await on_queued(len(self.waiters))
+                await future
+            except BaseException:
+                # Cancelled, or on_queued failed: never leave a waiter or a lease nobody will use.
+                if future.done() and not future.cancelled():
+                    # The API was handed over just as the waiter gave up; pass it on without a cooldown.
+                    lease.used = False
+                    self._release(lease)
+                else:
+                    self.waiters = deque((waiting, f) for waiting, f in self.waiters if f is not future)
+                raise
+            lease.granted_at = time.monotonic()
+
+        try:
+            yield lease
+        finally:
+            self._release(lease)
+
+    def _release(self, lease: Lease) -> None:
+        if self.current is not lease:
+            return
+        self.current = None
+        if lease.used:
+            self.released_at = time.monotonic()
+        self._schedule_handoff()
+
+    def _schedule_handoff(self) -> None:
+        if self.current is not None or not self.waiters or self.handoff is not None:
+            return
+        self.handoff = asyncio.get_running_loop().call_later(self.available_in(), self._hand_off)
+
+    def _hand_off(self) -> None:
+        self.handoff = None
+        if self.current is not None:
+            return
+        while self.waiters:
+            lease, future = self.waiters.popleft()
+            if not future.done():
+                self.current = lease
+                future.set_result(None)
+                return
@@ -0,0 +1,159 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from aiohttp import web
+
+logger = logging.getLogger("[WoS-Bot]")
+
+# Latency buckets in seconds, from a fast DB query up to a slow API call.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelSet = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative bucket counts plus the sum and count of observed values."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """In-process registry of labelled counters, gauges and histograms, renderable as Prometheus text."""
+
+    def __init__(self, prefix: str = "wosbot"):
+        self.prefix = prefix
+        self.counters: dict[str, dict[LabelSet, float]] = {}
+        self.gauges: dict[str, dict[LabelSet, float]] = {}
+        self.histograms: dict[str, dict[LabelSet, Histogram]] = {}
+        self.buckets: dict[str, tuple[float, ...]] = {}
+        self.collectors: list[Callable[["Metrics"], None]] = []
+
+    @staticmethod
+    def _labels(labels: dict) -> LabelSet:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter."""
+        series = self.counters.setdefault(name, {})
+        key = self._labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge."""
+        self.gauges.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] | None = None, **labels) -> None:
+        """Record a value in a histogram; `buckets` only applies the first time a histogram is used."""
+        buckets = self.buckets.setdefault(name, buckets or DEFAULT_BUCKETS)
+        series = self.histograms.setdefault(name, {})
+        key = self._labels(labels)
+        if key not in series:
+            series[key] = Histogram(buckets)
+        series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe the wall time of a block in a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector: Callable[["Metrics"], None]) -> None:
+        """Register a callback that refreshes gauges right before they are read."""
+        self.collectors.append(collector)
+
+    def collect(self) -> None:
+        """Run every collector."""
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+
+    def counter_values(self, name: str) -> dict[LabelSet, float]:
+        return dict(self.counters.get(name, {}))
+
+    def gauge_value(self, name: str, **labels) -> float | None:
+        return self.gauges.get(name, {}).get(self._labels(labels))
+
+    def histogram_series(self, name: str) -> dict[LabelSet, Histogram]:
+        return dict(self.histograms.get(name, {}))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        self.collect()
+        lines = []
+
+        def series_name(name: str, labels: LabelSet, suffix: str = "", extra: LabelSet = ()) -> str:
+            pairs = ",".join(
+                f'{key}="{value}"'.replace("\n", " ")
+                for key, value in labels + extra
+            )
+            return f"{self.prefix}_{name}{suffix}" + (f"{{{pairs}}}" if pairs else "")
+
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            lines.extend(f"{series_name(name, labels)} {value}" for labels, value in series.items())
+
+        for name, series in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.extend(f"{series_name(name, labels)} {value}" for labels, value in series.items())
+
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{series_name(name, labels, '_bucket', (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{series_name(name, labels, '_bucket', (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{series_name(name, labels, '_sum')} {histogram.sum}")
+                lines.append(f"{series_name(name, labels, '_count')} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, port: int, host: str = "127.0.0.1") -> web.AppRunner:
+        """Serve the metrics at /metrics on a local port."""
+
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return runner
+
+
+# Shared by the helpers, which cannot import the globals in bot/__init__.py.
+metrics = Metrics()
@@ -1,13 +1,43 @@
 import asyncio
+import heapq
+import inspect
+import itertools
 import re
 import time
+from collections import deque
 from typing import Final
 
-from bot import AUTO_RENAME_USERS, api, logger
-from bot.database.players import edit_local_name, get_local_name
+from bot import (AUTO_RENAME_USERS, EXTERNAL_WORKERS, REDEEM_WORKERS, api,
+                 dispatcher, logger, rate_limiter)
+from bot.database.gift_code import (SCHEDULABLE_STATES, record_dead_gift_code,
+                                    transition_gift_code)
+from bot.database.players import bulk_edit_local_names, get_local_names
+from bot.database.redemptions import (list_outstanding_redemptions,
+                                      record_redemption)
+from bot.database.jobs import (checkpoint_job, create_job, finish_job,
+                              get_job_counters, get_job_progress,
+                              skip_job_code)
 from bot.helpers.api import API
+from bot.helpers.metrics import metrics
 
 START_UNIX_TIME: Final[int] = int(time.time())
+RETRY_DELAY: Final[int] = 20
+PROGRESS_BATCH: Final[int] = 20
+WATCH_INTERVAL: Final[int] = 5
+# Seconds an external job may go without any worker claiming or finishing work before it is failed.
+WORKER_STALL_TIMEOUT: Final[int] = 300
+MAX_ATTEMPTS: Final[int] = 5
+PROBE_ATTEMPTS: Final[int] = 3
+
+# API responses that mean we are calling too fast and should slow down. A wrong captcha
+# ("captcha error") is an OCR miss rather than throttling, so it does not count.
+BACKOFF_RESULTS: Final[tuple[str, ...]] = ("rate limited", "captcha fetch error")
+# Answers that show the API accepted the call, the only ones that speed the rate limiter up. Failed
+# requests and unknown errors leave the rate alone; outages are handled by the circuit breaker.
+ACCEPTED_RESULTS: Final[tuple[str, ...]] = ("successfully claimed", "already claimed", "captcha error")
+
+# Sweep duration buckets in seconds, from a handful of players up to a large roster.
+SWEEP_BUCKETS: Final[tuple[float, ...]] = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
 
 def get_start_time() -> int:
     return START_UNIX_TIME
@@ -27,71 +57,420 @@ def is_valid_id(player_id: str) -> bool:
         return False
 
 
-async def recursive_redeem(message, code: str, players: list[tuple[str, float]], counters: dict = None, depth: int = 0):
-    """Recursively redeem a gift code for a list of players with rate-limiting."""
-    counters = counters or {"already_claimed": 0, "successfully_claimed": 0, "error": 0}
-    batches = [(i, players[i:i + 20]) for i in range(0, len(players), 20)]
-    retry = []
-
-    if depth > 0:
-        current_time = time.time()
-        wait_time = 0
-        for pid, last_called in players:
-            ready_time = last_called + 20
-            if current_time < ready_time:
-                wait_time += ready_time - current_time
-                current_time = ready_time
-            current_time += 3
-        first_player_ready_in = players[0][1] + 20 - time.time()
-        initial_wait = max(0, first_player_ready_in)
-        waited_initial_wait = initial_wait == 0
-    else:
-        wait_time = 0
-        initial_wait = 0
-        waited_initial_wait = True
+def parse_roster_lines(text: str) -> tuple[list[tuple[str, int]], list[str]]:
+    """Parse `id[,rank]` lines into (player_id, rank) pairs, returning them along with the lines that could not be parsed."""
+    entries = {}
+    invalid = []
+    for line in text.splitlines():
+        fields = [field.strip() for field in re.split(r"[,;\t ]+", line.strip()) if field.strip()]
+        if not fields or fields[0].startswith("#") or fields[0].lower() in ("id", "player_id"):
+            continue
+
+        player_id = fields[0]
+        try:
+            rank = int(fields[1]) if len(fields) > 1 else 1
+        except ValueError:
+            rank = 0
+        if not is_valid_id(player_id) or rank not in range(1, 6):
+            invalid.append(line.strip())
+            continue
+        entries[player_id] = rank
+    return list(entries.items()), invalid
+
+
+class RenameBuffer:
+    """Tracks roster names in memory during a run and writes changed names in bulk."""
+
+    def __init__(self):
+        self.names: dict[str, str | None] = {}
+        self.changed: dict[str, str] = {}
+
+    async def load(self) -> None:
+        """Load the current names of the whole roster."""
+        self.names = await get_local_names()
 
-    progress_message = await message.reply("Redeeming gift code... (0/{})".format(len(players)))
+    def update(self, player_id: str, nickname: str) -> None:
+        """Queue a rename if the in-game nickname differs from the stored name."""
+        new_name = sanitize_username(nickname)
+        if player_id in self.names and self.names[player_id] != new_name:
+            self.names[player_id] = new_name
+            self.changed[player_id] = new_name
 
-    for i, batch in batches:
-        msg = "Redeeming gift code" if depth == 0 else f"Redeeming gift code (retry {depth})"
-        next_update = int(1 + time.time() + (len(batch) * 3) + wait_time)
-        await progress_message.edit_text(
-            f"{msg}... ({min(i + len(batch), len(players))}/{len(players)})<t:{next_update}:R>"
+    async def flush(self) -> None:
+        """Write all queued renames in one transaction."""
+        if self.changed:
+            changed, self.changed = self.changed, {}
+            if await bulk_edit_local_names(changed):
+                logger.info(f"Renamed {len(changed)} players")
+
+
+def format_report(counters: dict, dead_codes: dict, retries: int, gave_up: int = 0) -> str:
+    """Build the combined per-code report of a redemption run."""
+    sections = []
+    for code, code_counters in counters.items():
+        section = (
+            f"📊 Report: Gift code `{code}`\n"
+            f"✅ Successful: {code_counters['successfully_claimed']}\n"
+            f"🔄 Already claimed: {code_counters['already_claimed']}"
         )
+        if code in dead_codes:
+            section += f"\n❌ Stopped: {dead_codes[code]}"
+        sections.append(section)
+    report = "\n\n".join(sections) + f"\n\n🔄 Retries: {retries}"
+    if gave_up:
+        report += f"\n⚠️ Gave up after {MAX_ATTEMPTS} attempts: {gave_up} players"
+    return report
 
-        if not waited_initial_wait:
-            await asyncio.sleep(initial_wait)
-            waited_initial_wait = True
 
-        for player, ready in batch:
-            if time.time() < (ready + 20):
-                await asyncio.sleep(ready + 20 - time.time())
+def record_sweep(duration: float, calls: int, players: int, status: str) -> None:
+    """Record the duration and throughput of a redemption sweep."""
+    metrics.observe("sweep_duration_seconds", duration, buckets=SWEEP_BUCKETS)
+    metrics.inc("sweeps_total", status=status)
+    metrics.inc("sweep_players_total", players)
+    metrics.set("sweep_last_duration_seconds", duration)
+    metrics.set("sweep_last_calls_per_second", calls / duration if duration else 0)
+    logger.info(f"Sweep {status}: {calls} redeem calls for {players} players in {duration:.1f}s")
 
-            start = time.time()
-            exit, counter, result, player_data = await api.redeem_code(code, player)
 
-            if exit:
-                await progress_message.edit_text(f"❌ Error: {result}")
-                return
-            else:
-                counters[counter] += 1
-                if "error" in result:
-                    retry.append((player, time.time()))
-                if player_data and AUTO_RENAME_USERS:
-                    new_name = sanitize_username(player_data["data"]["nickname"])
-                    local_name = await get_local_name(player)
-                    if new_name != local_name:
-                        await edit_local_name(player, new_name)
-
-            await asyncio.sleep(max(0, 3 - (time.time() - start)))
-
-    if retry:
-        await recursive_redeem(message, code, retry, counters, depth + 1)
+async def apply_feedback(limiter, result: str) -> None:
+    """Tune a rate limiter from the result of a redeem call, for both the in-process and the shared limiter."""
+    if result in BACKOFF_RESULTS:
+        adjusted = limiter.on_backoff()
+    elif result in ACCEPTED_RESULTS:
+        adjusted = limiter.on_success()
     else:
-        summary = (
-            f"📊 Report: Gift code `{code}`\n"
-            f"✅ Successful: {counters['successfully_claimed']}\n"
-            f"🔄 Already claimed: {counters['already_claimed']}\n"
-            f"🔄 Retries: {depth}"
+        return
+    if inspect.isawaitable(adjusted):
+        await adjusted
+
+
+async def redeem_player_codes(player: str, codes: list[str], limiter, job_id: int, dead_codes: dict[str, str], aborted=None) -> tuple[list[tuple[str, str, str]], dict | None, str | None, int]:
+    """Redeem a player's codes one at a time, returning the (player_id, code, outcome) results, the latest profile, the error that must abort the run (if any) and the number of calls made.
+
+    Codes the API reports as unusable are added to `dead_codes`, skipped for the rest of the job and
+    moved to their terminal state. `aborted` is checked after every token, so the player is left as
+    soon as another one hit a fatal error.
+    """
+    results = []
+    profile = None
+    calls = 0
+    for code in codes:
+        if code in dead_codes:
+            continue
+
+        await limiter.acquire()
+        if aborted is not None and aborted():
+            break
+
+        exit, counter, result, player_data = await api.redeem_code(code, player)
+        calls += 1
+        metrics.inc("redeem_results_total", result=result)
+
+        if exit:
+            if counter is None:
+                # The code itself is unusable, keep going with the other codes.
+                if code not in dead_codes:
+                    dead_codes[code] = result
+                    await skip_job_code(job_id, code, result)
+                    await record_dead_gift_code(code, result)
+                continue
+            return results, profile, result, calls
+
+        await apply_feedback(limiter, result)
+        results.append((player, code, counter))
+        profile = player_data or profile
+    return results, profile, None, calls
+
+
+async def probe_codes(codes: list[str], players: list[tuple[str, list[str]]]) -> tuple[list[str], list[tuple[str, list[str]]], dict[str, str], list[tuple[str, str, str]]]:
+    """Redeem each code for one canary player before the sweep, so a dead code costs a single call.
+
+    The canary is the first (highest-rank) player still needing the code. Codes the API reports as
+    unusable are moved to their terminal state and left out; a canary whose redemption went through is
+    recorded and dropped from that code's sweep. Inconclusive probes keep the code in the sweep.
+    Returns the live codes, the players still needing them, the dead codes with their reason and the
+    (player_id, code, outcome) results of the canaries, for run_redemption to include in its job and report.
+    """
+    live = []
+    dead = {}
+    probed = []
+    for code in codes:
+        canary = next((player for player, player_codes in players if code in player_codes), None)
+        if canary is None:
+            continue
+
+        await transition_gift_code(code, "probing")
+        for _ in range(PROBE_ATTEMPTS):
+            await rate_limiter.acquire()
+            exit, counter, result, _ = await api.redeem_code(code, canary)
+            metrics.inc("redeem_results_total", result=result)
+            metrics.inc("code_probes_total", result=result)
+            await apply_feedback(rate_limiter, result)
+            if counter != "error":
+                break
+
+        if exit and counter is None:
+            dead[code] = result
+            await record_dead_gift_code(code, result)
+            logger.info(f"Probe of gift code {code} for player {canary}: {result}, skipping the sweep")
+            continue
+
+        await transition_gift_code(code, "active", from_states=SCHEDULABLE_STATES)
+        live.append(code)
+        if counter in ("successfully_claimed", "already_claimed"):
+            await record_redemption(canary, code, counter)
+            probed.append((canary, code, counter))
+        logger.info(f"Probe of gift code {code} for player {canary}: {result}")
+
+    claimed = {(player, code) for player, code, _ in probed}
+    remaining = []
+    for player, player_codes in players:
+        player_codes = [code for code in player_codes if code in live and (player, code) not in claimed]
+        if player_codes:
+            remaining.append((player, player_codes))
+    return live, remaining, dead, probed
+
+
+async def finish_codes(codes: list[str], min_rank: int | None = None) -> list[str]:
+    """Mark the codes no player still needs as done, returning the ones that are still outstanding.
+
+    Players given up after MAX_ATTEMPTS keep their code active, so the next run sweeps only them.
+    """
+    outstanding = {code for _, player_codes in await list_outstanding_redemptions(codes, min_rank) for code in player_codes}
+    for code in codes:
+        if code not in outstanding:
+            # Codes found dead during the sweep already left the schedulable states and stay there.
+            await transition_gift_code(code, "done")
+    return [code for code in codes if code in outstanding]
+
+
+async def scheduled_redeem(message, codes: list[str], players: list[tuple[str, list[str]]], job_id: int = None, counters: dict = None) -> bool:
+    """Redeem every outstanding gift code per player with a pool of rate-limited workers.
+
+    First attempts are taken in order while failed players wait in a heap keyed by the time their
+    retry delay ends, so retries are interleaved with the main pass as soon as they become eligible
+    instead of waiting for another full pass. A player is given up after MAX_ATTEMPTS attempts.
+    Outcomes are checkpointed to the job every batch; returns False if the run was aborted.
+    """
+    counters = counters or {code: {"already_claimed": 0, "successfully_claimed": 0, "error": 0} for code in codes}
+    dead_codes = {}
+    renames = None
+    if AUTO_RENAME_USERS:
+        renames = RenameBuffer()
+        await renames.load()
+
+    pending = deque((player, player_codes, 0) for player, player_codes in players)
+    retries: list[tuple[float, int, str, list[str], int]] = []
+    sequence = itertools.count()
+    wakeup = asyncio.Event()
+    outcomes = []
+    processed = 0
+    calls = 0
+    done = 0
+    active = 0
+    retried = 0
+    gave_up = 0
+    fatal = None
+
+    label = "gift code" if len(codes) == 1 else f"{len(codes)} gift codes"
+    progress_message = await dispatcher.reply(message, f"Redeeming {label}... (0/{len(players)})")
+
+    def report_progress():
+        calls = sum(len(player_codes) for _, player_codes in players) / max(1, len(players))
+        next_update = int(1 + time.time() + min(PROGRESS_BATCH, len(players) - done) * calls / rate_limiter.rate)
+        waiting = f", {len(retries)} waiting to retry" if retries else ""
+        dispatcher.edit(progress_message, f"Redeeming {label}... ({done}/{len(players)}{waiting})<t:{next_update}:R>")
+
+    async def next_player():
+        """Wait for the next player to work on, or return None once nothing is left."""
+        while fatal is None:
+            now = time.time()
+            if retries and retries[0][0] <= now:
+                _, _, player, player_codes, attempts = heapq.heappop(retries)
+                return player, player_codes, attempts
+            if pending:
+                return pending.popleft()
+            if not retries and active == 0:
+                return None
+
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), retries[0][0] - now if retries else None)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def worker():
+        nonlocal processed, done, active, retried, gave_up, fatal
+        while (item := await next_player()) is not None:
+            player, player_codes, attempts = item
+            active += 1
+            try:
+                failed = await redeem_player(player, player_codes)
+            finally:
+                active -= 1
+
+            if failed is None:
+                break
+            if failed and attempts + 1 < MAX_ATTEMPTS:
+                heapq.heappush(retries, (time.time() + RETRY_DELAY, next(sequence), player, failed, attempts + 1))
+                retried += 1
+            else:
+                gave_up += bool(failed)
+                done += 1
+            # Idle workers may be waiting on a retry that is now due earlier, or for the run to end.
+            wakeup.set()
+
+            processed += 1
+            if processed % PROGRESS_BATCH == 0:
+                report_progress()
+                await flush()
+        wakeup.set()
+
+    async def redeem_player(player: str, player_codes: list[str]) -> list[str] | None:
+        """Redeem a player's codes, returning the ones that failed, or None if the run was aborted."""
+        nonlocal fatal, calls
+        results, profile, error, made = await redeem_player_codes(
+            player, player_codes, rate_limiter, job_id, dead_codes, lambda: fatal is not None
         )
-        await progress_message.edit_text(summary)
\ No newline at end of file
+        calls += made
+        for _, code, counter in results:
+            counters[code][counter] += 1
+        outcomes.extend(results)
+        if error is not None:
+            fatal = error
+        if fatal is not None:
+            return None
+
+        if profile and renames is not None:
+            renames.update(player, profile["data"]["nickname"])
+        return [code for _, code, counter in results if counter == "error"]
+
+    async def watch_breaker():
+        """Tell the chat once per outage that the run is paused, and edit that notice when it resumes."""
+        while True:
+            await api.breaker.opened.wait()
+            paused = time.time()
+            notice = await dispatcher.reply(
+                message,
+                f"⏸ The gift code API is not responding, the run is paused. "
+                f"Checking again <t:{int(paused + api.breaker.retry_in())}:R>."
+            )
+            await api.breaker.closed.wait()
+            dispatcher.edit(notice, f"▶️ The gift code API recovered after {time.time() - paused:.0f}s, resuming the run.")
+
+    async def flush():
+        batch = outcomes[:]
+        del outcomes[:len(batch)]
+        await checkpoint_job(job_id, batch)
+        if renames is not None:
+            await renames.flush()
+
+    report_progress()
+    started = time.perf_counter()
+    breaker_watch = asyncio.create_task(watch_breaker())
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(REDEEM_WORKERS, len(players))))]
+    completed = False
+    try:
+        await asyncio.gather(*workers)
+        completed = True
+    finally:
+        # If one worker failed, stop the others before the caller hands the API to the next job.
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        breaker_watch.cancel()
+        # Also runs on cancellation so a shutdown keeps everything redeemed so far.
+        await flush()
+        record_sweep(time.perf_counter() - started, calls, len(players), "done" if completed and fatal is None else "aborted")
+
+    if fatal is not None:
+        dispatcher.edit(progress_message, f"❌ Error: {fatal}")
+        return False
+
+    dispatcher.edit(progress_message, format_report(counters, dead_codes, retried, gave_up))
+    logger.info(f"OCR pool stats after redeeming {', '.join(codes)}: {api.ocr.stats()}")
+    return True
+
+
+async def watch_job(message, codes: list[str], job_id: int) -> bool:
+    """Report the progress of a job processed by `python -m bot.worker` processes until it is finished.
+
+    Returns False if a worker aborted the job, or if no worker touched it for WORKER_STALL_TIMEOUT
+    seconds, so the API lease is not held forever when no workers are running.
+    """
+    label = "gift code" if len(codes) == 1 else f"{len(codes)} gift codes"
+    progress_message = await dispatcher.reply(message, f"Redeeming {label} with external workers...")
+    last_activity = time.monotonic()
+    last_snapshot = None
+
+    while True:
+        progress = await get_job_progress(job_id)
+        if progress.get("status") == "failed":
+            dispatcher.edit(progress_message, "❌ Error: the redemption job was aborted by a worker.")
+            return False
+
+        if progress and not progress["pending_players"]:
+            break
+
+        if progress:
+            snapshot = (progress["pending_players"], progress["failed_players"], progress["retries"])
+            if progress["leased_players"] or snapshot != last_snapshot:
+                last_activity = time.monotonic()
+                last_snapshot = snapshot
+            elif time.monotonic() - last_activity > WORKER_STALL_TIMEOUT:
+                logger.error(f"Redemption job {job_id} stalled, no worker touched it for {WORKER_STALL_TIMEOUT}s")
+                await finish_job(job_id, "failed")
+                dispatcher.edit(
+                    progress_message,
+                    f"❌ Error: no redemption worker picked up the job for {WORKER_STALL_TIMEOUT // 60} minutes. "
+                    "Is `python -m bot.worker` running?"
+                )
+                return False
+
+            done = progress["players"] - progress["pending_players"]
+            dispatcher.edit(progress_message, f"Redeeming {label} with external workers... ({done}/{progress['players']})")
+        await asyncio.sleep(WATCH_INTERVAL)
+
+    counters = {code: {"already_claimed": 0, "successfully_claimed": 0} for code in codes}
+    for code, code_counters in (await get_job_counters(job_id)).items():
+        counters.setdefault(code, {}).update(code_counters)
+    dispatcher.edit(
+        progress_message,
+        format_report(counters, progress["dead_codes"], progress["retries"], progress["failed_players"]),
+    )
+    return True
+
+
+async def run_redemption(message, codes: list[str], players: list[tuple[str, list[str]]], job_id: int = None, counters: dict = None, probed: list[tuple[str, str, str]] = None) -> bool:
+    """Run a redemption as a persisted job so it can be resumed after a restart, returning False if it was aborted.
+
+    `probed` are the canary results of probe_codes: they are recorded in the job and counted in the
+    report without being redeemed again.
+    With misc.external_workers the job is left to the worker processes and only its progress is reported.
+    """
+    probed = [(player, code, outcome) for player, code, outcome in probed or [] if code in codes]
+    if job_id is None:
+        job_players = {player: list(player_codes) for player, player_codes in players}
+        for player, code, _ in probed:
+            job_players.setdefault(player, []).append(code)
+        job_id = await create_job(codes, list(job_players.items()), message.chat.id)
+        await checkpoint_job(job_id, probed)
+    if probed and counters is None:
+        counters = {code: {"already_claimed": 0, "successfully_claimed": 0, "error": 0} for code in codes}
+        for _, code, outcome in probed:
+            counters[code][outcome] += 1
+
+    try:
+        if EXTERNAL_WORKERS:
+            success = await watch_job(message, codes, job_id)
+        else:
+            # Wait for the OCR models started at boot rather than loading them mid-run.
+            await api.ocr.warmup()
+            success = await scheduled_redeem(message, codes, players, job_id, counters)
+    except Exception:
+        # Not left running for /status and a replay after restart; a cancelled (shut down) job is, so it can resume.
+        await finish_job(job_id, "failed")
+        raise
+    await finish_job(job_id, "done" if success else "failed")
+    return success
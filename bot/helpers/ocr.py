@@ -0,0 +1,151 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from bot.helpers.metrics import metrics
+
+# Each pool worker (process or thread) keeps its own warm model here.
+_local = threading.local()
+
+
+def _load_model() -> None:
+    """Load a ddddocr model for the current worker."""
+    # Imported here so only the pool workers pay for loading onnxruntime.
+    import ddddocr
+
+    _local.ocr = ddddocr.DdddOcr(show_ad=False)
+
+
+def _warm() -> None:
+    """Make sure the current worker has loaded its model."""
+    if getattr(_local, "ocr", None) is None:
+        _load_model()
+
+
+def _decode_restricted(result: dict) -> str:
+    """Greedily decode ddddocr's per-step probabilities over a restricted charset."""
+    charsets = result["charsets"]
+    prediction = []
+    last = None
+    for step in result["probability"]:
+        char = charsets[max(range(len(step)), key=step.__getitem__)]
+        if char != last and char != "":
+            prediction.append(char)
+        last = char
+    return "".join(prediction)
+
+
+def _classify(captcha_bytes: bytes, charset: int | str | None = None) -> tuple[str, float]:
+    """Classify a captcha image, returning the prediction and the inference time in seconds."""
+    if getattr(_local, "ocr", None) is None:
+        _load_model()
+
+    start = time.perf_counter()
+    if charset is None:
+        prediction = _local.ocr.classification(captcha_bytes)
+    else:
+        _local.ocr.set_ranges(charset)
+        prediction = _decode_restricted(_local.ocr.classification(captcha_bytes, probability=True))
+    return prediction, time.perf_counter() - start
+
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    """Start method for the OCR processes.
+
+    The pool starts after the database and Telegram threads are running, and forking a multi-threaded
+    process can deadlock the child. A fork server avoids that. Preloading this module there means
+    the `bot` package is imported once, not once per worker; importing it starts no threads.
+    Platforms without a fork server fall back to spawn.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class OCRExecutor:
+    """Runs captcha classification in a pool of workers so the event loop never blocks on inference."""
+
+    def __init__(self, workers: int = 1, mode: str = "process"):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self._executor: Executor | None = None
+
+        self.warming: asyncio.Future | None = None
+        self.warmup_time: float | None = None
+        self.pending = 0
+        self.completed = 0
+        self.inference_time = 0.0
+        self.wait_time = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        """The worker pool, created on first use so importing `bot`, as every pool process does, creates none."""
+        if self._executor is None:
+            if self.mode == "thread":
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="ocr", initializer=_load_model
+                )
+            else:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=_pool_context(), initializer=_load_model
+                )
+        return self._executor
+
+    async def warmup(self) -> None:
+        """Start every worker and load its model; concurrent and later calls wait for the same warmup."""
+        if self.warming is None:
+            self.warming = asyncio.ensure_future(self._warmup())
+        await asyncio.shield(self.warming)
+
+    async def _warmup(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            # One task per worker makes the pool start all of them instead of reusing the first.
+            await asyncio.gather(*(loop.run_in_executor(self.executor, _warm) for _ in range(self.workers)))
+        except Exception:
+            # Let the next caller try again rather than failing every classification for good.
+            self.warming = None
+            raise
+        self.warmup_time = time.perf_counter() - start
+
+    async def classify(self, captcha_bytes: bytes, charset: int | str | None = None) -> str:
+        """Classify a captcha image in the pool and return the predicted text, optionally limited to a charset."""
+        await self.warmup()
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            prediction, inference = await loop.run_in_executor(self.executor, _classify, captcha_bytes, charset)
+        finally:
+            self.pending -= 1
+
+        wait = max(0.0, time.perf_counter() - start - inference)
+        self.completed += 1
+        self.inference_time += inference
+        self.wait_time += wait
+        metrics.observe("ocr_inference_seconds", inference)
+        metrics.observe("ocr_wait_seconds", wait)
+        return prediction
+
+    def stats(self) -> dict:
+        """Return the queue depth and average latencies (in milliseconds) of the pool."""
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "mode": self.mode,
+            "warmup_ms": None if self.warmup_time is None else round(self.warmup_time * 1000, 2),
+            "queue_depth": self.pending,
+            "completed": self.completed,
+            "avg_inference_ms": round(self.inference_time / completed * 1000, 2),
+            "avg_wait_ms": round(self.wait_time / completed * 1000, 2),
+        }
+
+    def shutdown(self) -> None:
+        """Stop the pool workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate is tuned AIMD-style from API feedback."""
+
+    def __init__(
+        self,
+        rate: float = 0.33,
+        burst: int = 1,
+        min_rate: float = 0.05,
+        max_rate: float = 2.0,
+        increase: float = 0.02,
+        decrease: float = 0.5,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and consume it."""
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self) -> None:
+        """Additively increase the rate after a request the API accepted."""
+        self._refill()
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_backoff(self) -> None:
+        """Multiplicatively decrease the rate after the API pushed back."""
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease)
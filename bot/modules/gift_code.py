@@ -1,131 +1,228 @@
 import asyncio
-import time
+import hashlib
+import re
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import datetime, timezone
 
-import aiohttp
 from pyrogram.client import Client
 from pyrogram.types import Message
 
-from bot import ADMINS, LOG_CHANNEL, RSS_INTERVAL, RSS_URL, api, logger
-from bot.database.gift_code import (delete_gift_code, get_active_gift_codes,
-                                    get_all_gift_codes, insert_gift_code,
-                                    update_gift_code_last_checked,
-                                    update_gift_code_status)
-from bot.database.players import list_players
-from bot.helpers.misc import recursive_redeem
+from bot import (ADMINS, AUTO_REDEEM_MIN_RANK, LOG_CHANNEL, RSS_INTERVAL,
+                 RSS_SOURCES, api, dispatcher, logger)
+from bot.database.feeds import (FeedState, get_feed_state, save_feed_state,
+                                touch_feed)
+from bot.database.gift_code import (SCHEDULABLE_STATES, get_active_gift_codes,
+                                    get_gift_code_states, sync_gift_codes,
+                                    transition_gift_code)
+from bot.database.redemptions import list_outstanding_redemptions
+from bot.helpers.misc import finish_codes, probe_codes, run_redemption
+
+# Parser settings used for any key a source in misc.rss_sources leaves out.
+SOURCE_DEFAULTS = {
+    "timeout": 10,
+    "item_path": ".//item",
+    "code_field": "title",
+    "date_field": "pubDate",
+    "date_format": "%a, %d %b %Y %H:%M:%S %z",
+}
+SOURCES = [{**SOURCE_DEFAULTS, "name": source.get("url"), **source} for source in RSS_SOURCES]
+
+
+def normalize_code(code: str) -> str:
+    """Remove all whitespace from a gift code."""
+    return re.sub(r"\s+", "", code)
+
+
+async def fetch_rss_feed(source: dict, feed_state: FeedState | None) -> tuple[str | None, dict | None]:
+    """Fetch an RSS source with a conditional request.
+
+    Returns the feed content along with the validators to store once it has been processed,
+    (None, None) when the feed has not changed since the last poll, or ("", None) on failure.
+    """
+    headers = {}
+    if feed_state and feed_state.etag:
+        headers["If-None-Match"] = feed_state.etag
+    if feed_state and feed_state.last_modified:
+        headers["If-Modified-Since"] = feed_state.last_modified
 
-
-async def fetch_rss_feed() -> str:
-    """Fetch the RSS feed from the specified URL."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(RSS_URL, timeout=10) as response:
-                response.raise_for_status()
-                return await response.text()
+        session = await api.init_session()
+        async with session.get(source["url"], headers=headers, timeout=source["timeout"]) as response:
+            if response.status == 304:
+                await touch_feed(source["url"])
+                return None, None
+            response.raise_for_status()
+            body = await response.read()
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_hash": hashlib.sha256(body).hexdigest(),
+            }
+            if feed_state and feed_state.content_hash == validators["content_hash"]:
+                await touch_feed(source["url"])
+                return None, None
+            return body.decode(response.get_encoding()), validators
     except Exception as e:
-        logger.error(f"Failed to fetch RSS feed: {str(e)}")
-        return ""
+        logger.error(f"Failed to fetch RSS feed {source['name']}: {str(e)}")
+        return "", None
+
+def utc_date(pub_date: datetime) -> datetime:
+    """Normalize a publication date to UTC, reading dates without an offset as UTC."""
+    if pub_date.tzinfo is None:
+        return pub_date.replace(tzinfo=timezone.utc)
+    return pub_date.astimezone(timezone.utc)
 
-async def parse_rss_feed(xml_content: str) -> list[tuple[str, str]]:
-    """Parse the RSS feed and extract gift codes and publication dates."""
+async def parse_rss_feed(xml_content: str, source: dict) -> list[tuple[str, str]]:
+    """Parse an RSS source and extract gift codes and publication dates."""
     try:
         root = ET.fromstring(xml_content)
         codes = []
-        for item in root.findall(".//item"):
-            code = item.find("title").text.strip()
-            pub_date = item.find("pubDate").text.strip()
-            pub_date_dt = datetime.strptime(pub_date, "%a, %d %b %Y %H:%M:%S %z")
-            pub_date_iso = pub_date_dt.isoformat()
+        for item in root.findall(source["item_path"]):
+            code = normalize_code(item.find(source["code_field"]).text)
+            pub_date = item.find(source["date_field"]).text.strip()
+            pub_date_iso = utc_date(datetime.strptime(pub_date, source["date_format"])).isoformat()
             codes.append((code, pub_date_iso))
-        logger.info(f"Parsed {len(codes)} gift codes from RSS feed")
+        logger.info(f"Parsed {len(codes)} gift codes from RSS feed {source['name']}")
         return codes
     except Exception as e:
-        logger.error(f"Failed to parse RSS feed: {str(e)}")
+        logger.error(f"Failed to parse RSS feed {source['name']}: {str(e)}")
         return []
 
-async def update_gift_codes(client: Client):
-    """Update gift codes in the database and redeem new/active codes."""
-    xml_content = await fetch_rss_feed()
+async def poll_source(source: dict) -> tuple[list[tuple[str, str]] | None, dict | None]:
+    """Poll one RSS source, returning its codes (None on failure) and the validators to store if it changed."""
+    feed_state = await get_feed_state(source["url"])
+    xml_content, validators = await fetch_rss_feed(source, feed_state)
+    if xml_content is None:
+        return feed_state.get_codes(), None
     if not xml_content:
-        logger.warning("No RSS content fetched, skipping update")
-        return
+        return None, None
+
+    codes = await parse_rss_feed(xml_content, source)
+    if not codes:
+        return None, None
+    return codes, {**validators, "codes": codes}
+
+def merge_source_codes(results: list[tuple[list[tuple[str, str]] | None, dict | None]]) -> list[tuple[str, str, str]]:
+    """Deduplicate codes across sources case-insensitively, crediting each to the source that published it first."""
+    merged = {}
+    for source, (codes, _) in zip(SOURCES, results):
+        for code, pub_date in codes or []:
+            key = code.casefold()
+            # Compared as datetimes, since feeds (or codes cached before dates were normalized) may use other offsets.
+            if key not in merged or utc_date(datetime.fromisoformat(pub_date)) < utc_date(datetime.fromisoformat(merged[key][1])):
+                merged[key] = (merged.get(key, (code,))[0], pub_date, source["name"])
+    return list(merged.values())
+
+async def sync_rss_codes(client: Client, rss_codes: list[tuple[str, str, str]], recipient: int | None, expire: bool) -> bool:
+    """Store new gift codes from the RSS sources and expire the ones that left all of them, returning False if the sync failed."""
+    synced = await sync_gift_codes(rss_codes, expire)
+    if synced is None:
+        return False
+    new_codes, expired_codes = synced
+    new_codes = [(code, source) for code, _, source in rss_codes if code in new_codes]
 
-    rss_codes = await parse_rss_feed(xml_content)
-    if not rss_codes:
-        logger.warning("No codes parsed from RSS, skipping update")
-        return
-
-    rss_code_set = set(code for code, _ in rss_codes)
-    new_codes = []
-    for code, pub_date in rss_codes:
-        if await insert_gift_code(code, pub_date):
-            new_codes.append(code)
-        else:
-            await update_gift_code_last_checked(code)
-
-    recipient = LOG_CHANNEL if LOG_CHANNEL else (ADMINS[0] if ADMINS else None)
     if new_codes and recipient:
-        await client.send_message(
+        dispatcher.send(
+            client,
             recipient,
-            f"New gift codes found: {', '.join(new_codes)}"
+            f"New gift codes found: {', '.join(f'{code} ({source})' for code, source in new_codes)}"
         )
-        logger.info(f"Notified {recipient} about new gift codes: {', '.join(new_codes)}")
+        logger.info(f"Notified {recipient} about new gift codes: {', '.join(code for code, _ in new_codes)}")
+
+    if expired_codes:
+        logger.info(f"Marked gift codes as expired: {', '.join(expired_codes)}")
+    return True
 
-    db_codes = set(await get_all_gift_codes())
-    expired_codes = db_codes - rss_code_set
-    for code in expired_codes:
-        if await update_gift_code_status(code, "expired"):
-            logger.info(f"Marked gift code as expired: {code}")
+async def update_gift_codes(client: Client):
+    """Update gift codes in the database and redeem new/active codes."""
+    recipient = LOG_CHANNEL if LOG_CHANNEL else (ADMINS[0] if ADMINS else None)
+    results = await asyncio.gather(*(poll_source(source) for source in SOURCES))
+    if all(codes is None for codes, _ in results):
+        logger.warning("No RSS content fetched, skipping update")
+        return
+
+    if all(validators is None for _, validators in results):
+        # Nothing to sync, but codes left active by an unfinished run still get redeemed.
+        logger.info("RSS feeds unchanged since last poll, skipping sync")
+    else:
+        # Codes are only expired when every source could be read.
+        complete = all(codes is not None for codes, _ in results)
+        if not await sync_rss_codes(client, merge_source_codes(results), recipient, complete):
+            # Keep the old validators, so the next poll fetches and syncs these feeds again.
+            logger.warning("Gift code sync failed, feed state not saved")
         else:
-            await delete_gift_code(code)
+            for source, (_, validators) in zip(SOURCES, results):
+                if validators:
+                    await save_feed_state(source["url"], **validators)
 
     active_codes = await get_active_gift_codes()
     if not active_codes:
         logger.info("No active gift codes to redeem")
         return
 
-    try:
-        players_obj = await list_players()
-        players = [(player[0], 0) for player in players_obj]
-        logger.info(f"Found {len(players)} players for redemption")
-    except Exception as e:
-        logger.error(f"Failed to fetch players: {str(e)}")
-        return
-
     if not recipient:
         logger.error("No log channel or admins defined, cannot redeem codes")
         return
 
     async def send_dummy_message(content: str) -> Message:
-        return await client.send_message(recipient, content)
+        return await dispatcher.send(client, recipient, content)
 
-    for code, _ in active_codes:
-        if api.inUse:
-            logger.warning("API is in use, waiting before redeeming")
-            while api.inUse:
-                await asyncio.sleep(5)
-        if api.lastUsed + 60 > time.time():
-            wait_time = api.lastUsed + 60 - time.time()
-            logger.info(f"API on cooldown, waiting {wait_time} seconds")
-            await asyncio.sleep(wait_time)
+    codes = [code for code, _ in active_codes]
+    if api.lease.busy or api.lease.waiters:
+        logger.info(f"API is in use, queueing redemption of {', '.join(codes)}")
 
-        await api.init_session()
-        api.inUse = True
+    async with api.lease.hold(f"auto-redeem {', '.join(codes)}") as lease:
+        # Looked up once the API is ours, so work done by jobs ahead in the queue is not repeated,
+        # and codes a run ahead in the queue found dead are never scheduled.
+        try:
+            states = await get_gift_code_states(codes)
+            codes = [code for code in codes if states.get(code) in SCHEDULABLE_STATES]
+            players = await list_outstanding_redemptions(codes, AUTO_REDEEM_MIN_RANK) if codes else []
+            logger.info(f"Found {len(players)} players with outstanding gift codes")
+        except Exception as e:
+            logger.error(f"Failed to fetch players: {str(e)}")
+            lease.used = False
+            return
+
+        pending_codes = set(code for _, player_codes in players for code in player_codes)
+        for code in codes:
+            if code not in pending_codes:
+                await transition_gift_code(code, "done")
+                logger.info(f"All players already claimed gift code {code}, skipping redemption")
+        codes = [code for code in codes if code in pending_codes]
+        if not codes:
+            lease.used = False
+            return
 
         try:
-            progress_message = await send_dummy_message(f"Starting redemption for gift code `{code}`...")
-            await recursive_redeem(progress_message, code, players)
-            await update_gift_code_status(code, "redeemed")
-            await client.send_message(recipient, f"Completed redemption for gift code `{code}`.")
-            logger.info(f"Completed redemption for gift code: {code}")
+            codes, players, dead_codes, probed = await probe_codes(codes, players)
+            for code, reason in dead_codes.items():
+                dispatcher.send(client, recipient, f"❌ Skipping gift code `{code}`: {reason}")
+            if not codes:
+                return
+
+            code_list = ", ".join(f"`{code}`" for code in codes)
+            progress_message = await send_dummy_message(f"Starting redemption for gift codes {code_list}...")
+            if not await run_redemption(progress_message, codes, players, probed=probed):
+                # Left active, so the next poll picks the codes up again.
+                dispatcher.send(client, recipient, f"Redemption of gift codes {code_list} was aborted, retrying on the next check.")
+                logger.warning(f"Redemption of gift codes {', '.join(codes)} was aborted")
+                return
+            outstanding = await finish_codes(codes, AUTO_REDEEM_MIN_RANK)
+            if outstanding:
+                dispatcher.send(
+                    client,
+                    recipient,
+                    f"Redemption of gift codes {code_list} finished, players still missing "
+                    f"{', '.join(f'`{code}`' for code in outstanding)} are retried on the next check."
+                )
+                logger.info(f"Gift codes still outstanding after redemption: {', '.join(outstanding)}")
+                return
+            dispatcher.send(client, recipient, f"Completed redemption for gift codes {code_list}.")
+            logger.info(f"Completed redemption for gift codes: {', '.join(codes)}")
         except Exception as e:
-            await client.send_message(recipient, f"Failed to redeem gift code `{code}`: {str(e)}")
-            logger.error(f"Failed to redeem gift code {code}: {str(e)}")
-        finally:
-            api.lastUsed = time.time()
-            api.inUse = False
-            await api.session.close()
+            dispatcher.send(client, recipient, f"Failed to redeem gift codes {', '.join(codes)}: {str(e)}")
+            logger.error(f"Failed to redeem gift codes {', '.join(codes)}: {str(e)}")
 
 async def periodic_gift_code_check(client: Client):
     while True:
@@ -1,16 +1,35 @@
+import asyncio
+import csv
+import io
+import math
 from uuid import uuid4
 
 from pyrogram import filters
 from pyrogram.client import Client
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 
-from bot import ADMINS, api, logger
-from bot.database.players import (add_player, list_players, remove_player,
-                                  set_rank)
+from bot import ADMINS, REDEEM_WORKERS, api, logger, rate_limiter
+from bot.database.players import (add_player, add_players, count_players,
+                                  get_local_names, list_players,
+                                  list_players_page, remove_player, set_rank)
 from bot.helpers.api import API
-from bot.helpers.misc import is_valid_id, sanitize_username
+from bot.helpers.cache import TTLCache
+from bot.helpers.misc import (is_valid_id, parse_roster_lines,
+                              sanitize_username)
 
-pagination_data = {}
+PAGE_SIZE = 10
+# Logins retried per imported player when the API throttles or does not answer, with the delay doubling from VALIDATE_DELAY seconds.
+VALIDATE_ATTEMPTS = 4
+VALIDATE_DELAY = 5
+
+# Open /list sessions, keyed by session ID; abandoned sessions expire instead of piling up.
+pagination_data = TTLCache(maxsize=256, ttl=900)
+
+
+def page_key(player: tuple) -> tuple:
+    """Return the (rank, name, player_id) keyset position of a (player_id, name, rank) row."""
+    player_id, name, rank = player
+    return rank, name, player_id
 
 
 @Client.on_message(filters.command("add") & filters.private)
@@ -40,21 +59,17 @@ async def add_user(client: Client, message: Message):
         await message.reply("❌ Invalid user ID.")
         return
 
-    await api.init_session()
-    try:
-        err, _, _, user_data = await api.login_user(player_id)
-        if err or not user_data or "data" not in user_data or "nickname" not in user_data["data"]:
-            await message.reply("❌ Error: User not found or invalid API response.")
-            return
+    err, _, _, user_data = await api.cached_login(player_id)
+    if err or not user_data or "data" not in user_data or "nickname" not in user_data["data"]:
+        await message.reply("❌ Error: User not found or invalid API response.")
+        return
 
-        name = sanitize_username(user_data["data"]["nickname"])
-        success = await add_player(player_id, name, rank)
-        if success:
-            await message.reply(f"✅ Added user {name} to the database with rank R{rank}.")
-        else:
-            await message.reply("❌ User ID already exists in the database.")
-    finally:
-        await api.session.close()
+    name = sanitize_username(user_data["data"]["nickname"])
+    success = await add_player(player_id, name, rank)
+    if success:
+        await message.reply(f"✅ Added user {name} to the database with rank R{rank}.")
+    else:
+        await message.reply("❌ User ID already exists in the database.")
 
 
 @Client.on_message(filters.command("remove") & filters.private)
@@ -77,9 +92,85 @@ async def remove_user(client: Client, message: Message):
         await message.reply("❌ User ID not found in the database.")
 
 
-@Client.on_message(filters.command("list") & filters.private)
-async def list_users(client: Client, message: Message):
-    """Handle the /list command to display all players with pagination."""
+@Client.on_message(filters.command("import") & filters.private)
+async def import_users(client: Client, message: Message):
+    """Handle the /import command to add players in bulk from an `id[,rank]` CSV or text document."""
+    if message.from_user.id not in ADMINS:
+        await message.reply("❌ You are not authorized to use this command.")
+        return
+
+    document_message = message if message.document else message.reply_to_message
+    if not document_message or not document_message.document:
+        await message.reply("❌ Usage: send a CSV or text file of `id[,rank]` lines with the caption /import, or reply to one with /import.")
+        return
+
+    try:
+        file = await document_message.download(in_memory=True)
+        text = bytes(file.getbuffer()).decode("utf-8-sig")
+    except (UnicodeDecodeError, ValueError) as e:
+        await message.reply(f"❌ Could not read the file: {str(e)}")
+        return
+
+    entries, invalid = parse_roster_lines(text)
+    existing = await get_local_names()
+    new_entries = [(player_id, rank) for player_id, rank in entries if player_id not in existing]
+    skipped = len(entries) - len(new_entries)
+    if not new_entries:
+        await message.reply(
+            f"📥 Nothing to import.\n🔄 Already in the database: {skipped}\n❌ Invalid lines: {len(invalid)}"
+        )
+        return
+
+    progress_message = await message.reply(f"📥 Validating {len(new_entries)} players...")
+    semaphore = asyncio.Semaphore(max(1, REDEEM_WORKERS))
+    not_found = []
+    unvalidated = []
+
+    async def validate(player_id: str, rank: int):
+        for attempt in range(VALIDATE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(VALIDATE_DELAY * 2 ** (attempt - 1))
+            async with semaphore:
+                await rate_limiter.acquire()
+                err, counter, result, user_data = await api.cached_login(player_id)
+            if result == "rate limited":
+                rate_limiter.on_backoff()
+            elif result == "success":
+                rate_limiter.on_success()
+            # Throttled or unanswered logins say nothing about the player, so try again.
+            if result not in ("rate limited", "request failed"):
+                break
+        else:
+            unvalidated.append(player_id)
+            return None
+
+        if err or not user_data or "data" not in user_data or "nickname" not in user_data["data"]:
+            not_found.append(player_id)
+            return None
+        return player_id, sanitize_username(user_data["data"]["nickname"]), rank
+
+    validated = await asyncio.gather(*(validate(player_id, rank) for player_id, rank in new_entries))
+
+    added = await add_players([player for player in validated if player])
+    summary = (
+        f"📥 Import finished\n"
+        f"✅ Added: {added}\n"
+        f"🔄 Already in the database: {skipped}\n"
+        f"❌ Not found: {len(not_found)}\n"
+        f"⚠️ Could not validate: {len(unvalidated)}\n"
+        f"❌ Invalid lines: {len(invalid)}"
+    )
+    if not_found:
+        summary += f"\n\nNot found: {', '.join(f'`{player_id}`' for player_id in not_found[:50])}"
+    if unvalidated:
+        summary += f"\n\nCould not validate (API busy or unreachable, import them again later): {', '.join(f'`{player_id}`' for player_id in unvalidated[:50])}"
+    await progress_message.edit_text(summary)
+    logger.info(f"Admin {message.from_user.id} imported {added} players")
+
+
+@Client.on_message(filters.command("export") & filters.private)
+async def export_users(client: Client, message: Message):
+    """Handle the /export command to send the roster as a CSV file."""
     if message.from_user.id not in ADMINS:
         await message.reply("❌ You are not authorized to use this command.")
         return
@@ -89,37 +180,34 @@ async def list_users(client: Client, message: Message):
         await message.reply("📋 No players in the database.")
         return
 
-    rank_lists = {1: [], 2: [], 3: [], 4: [], 5: []}
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["id", "rank", "name"])
     for player_id, name, rank in players:
-        rank_lists[rank].append((name, player_id))
-
-    sorted_ranks = [rank_lists[rank] for rank in range(5, 0, -1)]
-    ranks = range(1, 6)
-    rank_lines = [[] for _ in range(5)]
+        writer.writerow([player_id, rank, name])
 
-    for index, rank in enumerate(sorted_ranks):
-        rank_lines[index].append(f"**R{ranks[-(index + 1)]}**")
-        rank_lines[index].append("")
-        for name, player_id in rank:
-            rank_lines[index].append(f"**{name}** (`{player_id}`)")
-        rank_lines[index].extend(["" for _ in range(10 - (len(rank_lines[index]) % 10))])
+    file = io.BytesIO(text.getvalue().encode("utf-8"))
+    file.name = "players.csv"
+    await message.reply_document(file, caption=f"📋 {len(players)} players")
 
-    lines = sum(rank_lines, [])
-    embeds_content = ["\n".join(lines[i:i + 10]) for i in range(0, len(lines), 10)]
 
-    if not embeds_content:
-        await message.reply("📋 No players to display.")
-        return
-
-    session_id = str(uuid4())
-    pagination_data[session_id] = {
-        "pages": embeds_content,
-        "current_page": 0,
-        "total_players": len(players),
-        "user_id": message.from_user.id
-    }
-
-    keyboard = InlineKeyboardMarkup([
+def render_page(players: list) -> str:
+    """Render a page of (player_id, name, rank) rows grouped under rank headers."""
+    lines = []
+    current_rank = None
+    for player_id, name, rank in players:
+        if rank != current_rank:
+            if lines:
+                lines.append("")
+            lines.extend([f"**R{rank}**", ""])
+            current_rank = rank
+        lines.append(f"**{name}** (`{player_id}`)")
+    return "\n".join(lines)
+
+
+def page_keyboard(session_id: str) -> InlineKeyboardMarkup:
+    """Build the navigation buttons of a /list session."""
+    return InlineKeyboardMarkup([
         [
             InlineKeyboardButton("Previous", callback_data=f"prev_{session_id}"),
             InlineKeyboardButton("Next", callback_data=f"next_{session_id}"),
@@ -127,13 +215,40 @@ async def list_users(client: Client, message: Message):
         ]
     ])
 
-    content = embeds_content[0]
-    await message.reply(
-        f"📋 **Players List**\n**Total players:** {len(players)}\n**Page 1/{len(embeds_content)}**\n\n{content}",
-        reply_markup=keyboard
+
+def page_text(players: list, page: int, total_players: int) -> str:
+    """Build the message text of a /list page."""
+    total_pages = max(1, math.ceil(total_players / PAGE_SIZE))
+    return (
+        f"📋 **Players List**\n**Total players:** {total_players}\n"
+        f"**Page {min(page + 1, total_pages)}/{total_pages}**\n\n{render_page(players)}"
     )
 
 
+@Client.on_message(filters.command("list") & filters.private)
+async def list_users(client: Client, message: Message):
+    """Handle the /list command to display all players with pagination."""
+    if message.from_user.id not in ADMINS:
+        await message.reply("❌ You are not authorized to use this command.")
+        return
+
+    total_players = await count_players()
+    players = await list_players_page(limit=PAGE_SIZE) if total_players else []
+    if not players:
+        await message.reply("📋 No players in the database.")
+        return
+
+    session_id = str(uuid4())
+    pagination_data.set(session_id, {
+        "user_id": message.from_user.id,
+        "page": 0,
+        "first": page_key(players[0]),
+        "last": page_key(players[-1]),
+    })
+
+    await message.reply(page_text(players, 0, total_players), reply_markup=page_keyboard(session_id))
+
+
 @Client.on_callback_query()
 async def handle_pagination(client: Client, callback_query):
     """Handle pagination button clicks."""
@@ -141,43 +256,41 @@ async def handle_pagination(client: Client, callback_query):
     session_id = data.split("_")[1]
     action = data.split("_")[0]
 
-    if session_id not in pagination_data:
+    session = pagination_data.get(session_id)
+    if session is None:
         await callback_query.answer("This session has expired.")
         return
 
-    session = pagination_data[session_id]
     if callback_query.from_user.id != session["user_id"]:
         await callback_query.answer("You are not authorized to use these buttons.")
         return
 
     if action == "close":
         await callback_query.message.delete()
-        del pagination_data[session_id]
+        pagination_data.pop(session_id)
         return
 
-    current_page = session["current_page"]
-    total_pages = len(session["pages"])
-
-    if action == "next" and current_page < total_pages - 1:
-        session["current_page"] += 1
-    elif action == "prev" and current_page > 0:
-        session["current_page"] -= 1
+    if action == "next":
+        players = await list_players_page(after=session["last"], limit=PAGE_SIZE)
+        page = session["page"] + 1
+    elif action == "prev" and session["page"] > 0:
+        players = await list_players_page(before=session["first"], limit=PAGE_SIZE)
+        page = session["page"] - 1
     else:
+        players = []
+
+    if not players:
         await callback_query.answer("No more pages in this direction.")
         return
 
-    content = session["pages"][session["current_page"]]
-    keyboard = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("Previous", callback_data=f"prev_{session_id}"),
-            InlineKeyboardButton("Next", callback_data=f"next_{session_id}"),
-            InlineKeyboardButton("Close", callback_data=f"close_{session_id}")
-        ]
-    ])
+    # Only the keys bounding the visible page are kept; every page is read from the database on demand.
+    session.update(page=page, first=page_key(players[0]), last=page_key(players[-1]))
+    pagination_data.set(session_id, session)
 
+    total_players = await count_players()
     await callback_query.message.edit_text(
-        f"📋 **Players List**\n**Total players:** {session['total_players']}\n**Page {session['current_page'] + 1}/{total_pages}**\n\n{content}",
-        reply_markup=keyboard
+        page_text(players, page, total_players),
+        reply_markup=page_keyboard(session_id)
     )
     await callback_query.answer()
 
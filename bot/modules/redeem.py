@@ -1,47 +1,141 @@
-import time
+from datetime import datetime
 
 from pyrogram import filters
 from pyrogram.client import Client
 from pyrogram.types import Message
 
-from bot import ADMINS, api, logger
-from bot.database.players import list_players
+from bot import ADMINS, api, dispatcher, logger
+from bot.database.gift_code import DEAD_CODE_STATES, get_gift_code_states
+from bot.database.jobs import (finish_job, get_job_counters,
+                               get_job_outstanding, list_running_jobs)
+from bot.database.redemptions import list_outstanding_redemptions
 from bot.helpers.api import API
-from bot.helpers.misc import recursive_redeem
+from bot.helpers.misc import finish_codes, probe_codes, run_redemption
 
 
 @Client.on_message(filters.command("redeem") & filters.private)
 async def redeem_code(client: Client, message: Message):
-    """Handle the /redeem command to redeem a gift code for all players."""
+    """Handle the /redeem command to redeem one or more gift codes for all players, highest rank first."""
     if message.from_user.id not in ADMINS:
         await message.reply("❌ You are not authorized to use this command.")
         return
 
-    if len(message.command) < 2:
-        await message.reply("❌ Usage: /redeem CODE")
-        return
+    args = message.command[1:]
+    min_rank = None
+    for flag in [arg for arg in args if arg.startswith("--min-rank")]:
+        index = args.index(flag)
+        value = flag.partition("=")[2] if "=" in flag else (args[index + 1] if index + 1 < len(args) else "")
+        del args[index:index + (1 if "=" in flag else 2)]
+        if not value.isdigit() or int(value) not in range(1, 6):
+            await message.reply("❌ --min-rank must be a number between 1 and 5.")
+            return
+        min_rank = int(value)
 
-    code = message.command[1]
-    if api.inUse:
-        await message.reply("❌ Error: The API is currently in use by another command.")
-        return
-    if api.lastUsed + 60 > time.time():
-        await message.reply("❌ Error: Waiting for API cooldown.")
+    if not args:
+        await message.reply("❌ Usage: /redeem CODE [CODE ...] [--min-rank N]")
         return
 
-    await api.init_session()
-    api.inUse = True
+    codes = list(dict.fromkeys(args))
+    states = await get_gift_code_states(codes)
+    dead = [code for code in codes if states.get(code) in DEAD_CODE_STATES.values()]
+    if dead:
+        await message.reply("⏭ Skipping " + ", ".join(f"`{code}` ({states[code]})" for code in dead))
+        codes = [code for code in codes if code not in dead]
+        if not codes:
+            return
+
+    async def on_queued(position: int):
+        holder = api.lease.current.label if api.lease.current else "the API cooldown"
+        await message.reply(f"⏳ Waiting for {holder}. Your redemption is #{position} in the queue and starts automatically.")
+
+    async with api.lease.hold(f"/redeem {' '.join(codes)}", on_queued) as lease:
+        # Looked up once the API is ours, so work done by jobs ahead in the queue is not repeated.
+        try:
+            players = await list_outstanding_redemptions(codes, min_rank)
+        except Exception as e:
+            lease.used = False
+            await message.reply(f"❌ Database error: {str(e)}")
+            return
+
+        scope = "All players" if min_rank is None else f"All R{min_rank}+ players"
+        if not players:
+            lease.used = False
+            await message.reply(f"✅ {scope} have already claimed {', '.join(f'`{code}`' for code in codes)}.")
+            return
+
+        codes, players, dead_codes, probed = await probe_codes(codes, players)
+        for code, reason in dead_codes.items():
+            await message.reply(f"❌ Skipping gift code `{code}`: {reason}")
+        if not codes:
+            return
+
+        # Also run when the canaries were the only players left, so their results are reported.
+        if await run_redemption(message, codes, players, probed=probed) and min_rank is None:
+            await finish_codes(codes)
 
-    try:
-        playersObj = await list_players()
-        players = [(player[0], 0) for player in playersObj]
-    except Exception as e:
-        api.inUse = False
-        await message.reply(f"❌ Database error: {str(e)}")
+
+@Client.on_message(filters.command("status") & filters.private)
+async def status_command(client: Client, message: Message):
+    """Handle the /status command to show the progress of unfinished redemption jobs."""
+    if message.from_user.id not in ADMINS:
+        await message.reply("❌ You are not authorized to use this command.")
         return
 
-    await recursive_redeem(message, code, players)
+    lines = []
+    if api.lease.current is not None:
+        lines.append(f"🔒 API in use by {api.lease.current.label}")
+    elif api.lease.available_in():
+        lines.append(f"🧊 API cooldown: {api.lease.available_in():.0f}s left")
+    for position, label in enumerate(api.lease.queue(), start=1):
+        lines.append(f"{position}. ⏳ {label}")
+    if lines:
+        lines.append("")
+
+    jobs = await list_running_jobs()
+    if not jobs:
+        lines.append("📭 No redemption jobs are running.")
+
+    for job in jobs:
+        started = datetime.fromtimestamp(job.created_at).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"**Job #{job.id}** (started {started})")
+        for code, counters in (await get_job_counters(job.id)).items():
+            total = sum(counters.values())
+            finished = total - counters.get("pending", 0)
+            lines.append(
+                f"`{code}`: {finished}/{total} done "
+                f"(✅ {counters.get('successfully_claimed', 0)}, "
+                f"🔄 {counters.get('already_claimed', 0)}, "
+                f"⏭ {counters.get('skipped', 0)})"
+            )
+        lines.append("")
+    await message.reply("\n".join(lines).strip())
+
+
+async def resume_redemption_jobs(client: Client):
+    """Resume redemption jobs that were interrupted by a restart, redeeming only their outstanding players."""
+    for job in await list_running_jobs():
+        codes = job.get_codes()
+        players = await get_job_outstanding(job.id)
+        if not players or job.chat_id is None:
+            await finish_job(job.id)
+            continue
 
-    api.lastUsed = time.time()
-    api.inUse = False
-    await api.session.close()
\ No newline at end of file
+        try:
+            async with api.lease.hold(f"resumed job #{job.id}"):
+                stored = await get_job_counters(job.id)
+                counters = {
+                    code: {
+                        "already_claimed": stored.get(code, {}).get("already_claimed", 0),
+                        "successfully_claimed": stored.get(code, {}).get("successfully_claimed", 0),
+                        "error": 0,
+                    }
+                    for code in codes
+                }
+                message = await dispatcher.send(
+                    client,
+                    job.chat_id, f"♻️ Resuming redemption job #{job.id} for {len(players)} players..."
+                )
+                logger.info(f"Resuming redemption job {job.id} for {len(players)} players")
+                await run_redemption(message, codes, players, job.id, counters)
+        except Exception as e:
+            logger.error(f"Failed to resume redemption job {job.id}: {str(e)}")
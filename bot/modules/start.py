@@ -13,9 +13,14 @@ async def help_command(_: Client, message: Message):
         "Available commands:\n"
         "- /start: Start the bot and get a welcome message.\n"
         "- /help: Show this help message.\n"
-        "- /redeem CODE: Redeem a gift code for all players (admin only).\n"
+        "- /redeem CODE [CODE ...] [--min-rank N]: Redeem gift codes for all players, highest rank first, optionally only rank N and above (admin only).\n"
+        "- /status: Show the progress of running redemption jobs (admin only).\n"
+        "- /stats: Show API, OCR, database and sweep metrics (admin only).\n"
         "- /checkgiftcodes: Manually check for new gift codes in rss (admin only).\n"
-        "- /add ID [RANK]: Add a new player with ID and optional rank (1-5, defaults to 1) (admin only).\n"        "- /remove ID: Remove a player by ID (admin only).\n"
+        "- /add ID [RANK]: Add a new player with ID and optional rank (1-5, defaults to 1) (admin only).\n"
+        "- /import: Add players in bulk from an attached `id[,rank]` CSV or text file (admin only).\n"
+        "- /export: Download all players as a CSV file (admin only).\n"
+        "- /remove ID: Remove a player by ID (admin only).\n"
         "- /list: List all players with pagination (admin only).\n"
         "- /setrank ID RANK: Update a player's rank (1-5) (admin only).\n\n"
         "For more details, visit the GitHub repository:"
@@ -0,0 +1,60 @@
+from pyrogram import filters
+from pyrogram.client import Client
+from pyrogram.types import Message
+
+from bot import ADMINS, api
+from bot.helpers.metrics import Histogram, metrics
+
+
+def format_latency(histogram: Histogram) -> str:
+    """Summarize a latency histogram as call count, average and estimated p95."""
+    average = histogram.sum / histogram.count * 1000 if histogram.count else 0
+    p95 = histogram.quantile(0.95)
+    p95 = "-" if p95 is None else ("> 30s" if p95 == float("inf") else f"≤ {p95 * 1000:.0f}ms")
+    return f"{histogram.count} calls, avg {average:.0f}ms, p95 {p95}"
+
+
+@Client.on_message(filters.command("stats") & filters.private)
+async def stats_command(client: Client, message: Message):
+    """Handle the /stats command to show API, OCR, database and sweep metrics."""
+    if message.from_user.id not in ADMINS:
+        await message.reply("❌ You are not authorized to use this command.")
+        return
+
+    metrics.collect()
+    lines = ["📈 **Bot Metrics**", ""]
+
+    lines.append("**API latency**")
+    for labels, histogram in sorted(metrics.histogram_series("api_request_seconds").items()):
+        lines.append(f"`{dict(labels)['endpoint']}`: {format_latency(histogram)}")
+
+    if api.breaker.is_open:
+        lines.append(f"⏸ Circuit open, next probe in {api.breaker.retry_in():.0f}s")
+
+    lines.extend(["", "**API err_codes**"])
+    for labels, count in sorted(metrics.counter_values("api_responses_total").items()):
+        labels = dict(labels)
+        lines.append(f"`{labels['endpoint']}` {labels['err_code']}: {count:.0f}")
+
+    lines.extend(["", "**Redeem results**"])
+    for labels, count in sorted(metrics.counter_values("redeem_results_total").items(), key=lambda item: -item[1]):
+        lines.append(f"{dict(labels)['result']}: {count:.0f}")
+
+    lines.extend(["", "**OCR and database**"])
+    for name, label in (("ocr_inference_seconds", "OCR inference"), ("ocr_wait_seconds", "OCR queue wait")):
+        for histogram in metrics.histogram_series(name).values():
+            lines.append(f"{label}: {format_latency(histogram)}")
+    for labels, histogram in sorted(metrics.histogram_series("db_query_seconds").items()):
+        lines.append(f"DB `{dict(labels)['statement']}`: {format_latency(histogram)}")
+
+    lines.extend(["", "**Sweeps**"])
+    sweeps = sum(metrics.counter_values("sweeps_total").values())
+    lines.append(f"Completed: {sweeps:.0f}")
+    duration = metrics.gauge_value("sweep_last_duration_seconds")
+    if duration is not None:
+        throughput = metrics.gauge_value("sweep_last_calls_per_second")
+        lines.append(f"Last: {duration:.1f}s at {throughput:.2f} calls/s")
+    lines.append(f"Rate limit: {metrics.gauge_value('rate_limit_per_second') or 0:.2f} calls/s")
+    lines.append(f"OCR queue depth: {metrics.gauge_value('ocr_queue_depth') or 0:.0f}")
+
+    await message.reply("\n".join(lines))
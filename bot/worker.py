@@ -0,0 +1,145 @@
+"""Standalone redemption workers: `python -m bot.worker [--processes N]`.
+
+Each worker process claims the pending (player, code) work of running redemption jobs from the
+database under a lease, redeems it and writes the outcomes back, while the bot process only creates
+the jobs and reports their progress (misc.external_workers). All workers draw from one rate budget
+stored in the database.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from bot import AUTO_RENAME_USERS, RATE_LIMIT, REDEEM_WORKERS, api, logger
+from bot.database import start_db, stop_db
+from bot.database.jobs import (checkpoint_job, claim_job_items, extend_leases,
+                               finish_job, release_leases)
+from bot.database.players import get_local_name
+from bot.database.rate_budget import SharedRateLimiter
+from bot.helpers.misc import (MAX_ATTEMPTS, PROGRESS_BATCH, RETRY_DELAY,
+                              RenameBuffer, redeem_player_codes)
+
+# Seconds a claim stays valid without a heartbeat before other workers may take the work over.
+LEASE = 120
+POLL_INTERVAL = 2
+
+
+async def redeem_claimed(job_id: int, player: str, codes: list[str], limiter: SharedRateLimiter, renames: RenameBuffer | None) -> list[tuple[str, str, str]] | None:
+    """Redeem a claimed player's codes, returning the (player_id, code, outcome) results, or None if the job must be aborted."""
+    # Dead codes are skipped for the whole job in the database, so other workers stop claiming them too.
+    outcomes, profile, fatal, _ = await redeem_player_codes(player, codes, limiter, job_id, {})
+    if fatal is not None:
+        logger.error(f"Aborting redemption job {job_id}: {fatal}")
+        await finish_job(job_id, "failed")
+        return None
+
+    if profile and renames is not None:
+        if player not in renames.names:
+            renames.names[player] = await get_local_name(player)
+        renames.update(player, profile["data"]["nickname"])
+    return outcomes
+
+
+async def claim_loop(owner: str, limiter: SharedRateLimiter, renames: RenameBuffer | None, stopping: asyncio.Event) -> None:
+    """Claim and redeem one player at a time until the worker is stopped."""
+    while not stopping.is_set():
+        claimed = await claim_job_items(owner, 1, LEASE)
+        if not claimed:
+            try:
+                await asyncio.wait_for(stopping.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        for job_id, player, codes in claimed:
+            try:
+                outcomes = await redeem_claimed(job_id, player, codes, limiter, renames)
+            except Exception as e:
+                logger.error(f"Failed to redeem for player {player} in job {job_id}: {str(e)}")
+                # Counted as a failed attempt, so the player waits for a retry and is given up after MAX_ATTEMPTS.
+                outcomes = [(player, code, "error") for code in codes]
+            if outcomes:
+                await checkpoint_job(job_id, outcomes, retry_at=time.time() + RETRY_DELAY, max_attempts=MAX_ATTEMPTS)
+            # Renames are written in batches, like in-process runs do.
+            if renames is not None and len(renames.changed) >= PROGRESS_BATCH:
+                await renames.flush()
+
+
+async def heartbeat(owners: list[str], stopping: asyncio.Event) -> None:
+    """Renew the leases of this process's claims until it stops."""
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), LEASE / 3)
+        except asyncio.TimeoutError:
+            await extend_leases(owners, LEASE)
+
+
+async def run_worker(index: int) -> None:
+    """Run REDEEM_WORKERS claim loops in this process."""
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+    owners = [f"{socket.gethostname()}:{os.getpid()}:{slot}" for slot in range(max(1, REDEEM_WORKERS))]
+    limiter = SharedRateLimiter(**RATE_LIMIT)
+    await limiter.init()
+    renames = None
+    if AUTO_RENAME_USERS:
+        renames = RenameBuffer()
+        await renames.load()
+
+    await api.init_session()
+    logger.info(f"Redemption worker {index} started with {len(owners)} slots")
+    try:
+        await asyncio.gather(
+            heartbeat(owners, stopping),
+            *(claim_loop(owner, limiter, renames, stopping) for owner in owners),
+        )
+    finally:
+        if renames is not None:
+            await renames.flush()
+        await release_leases(owners)
+        await api.close_session()
+        api.ocr.shutdown()
+        await stop_db()
+        logger.info(f"Redemption worker {index} stopped")
+
+
+def run_process(index: int) -> None:
+    try:
+        asyncio.run(run_worker(index))
+    except KeyboardInterrupt:
+        pass
+
+
+async def prepare_db() -> None:
+    # Create or migrate the schema once, before the worker processes open their own connections.
+    await start_db()
+    await stop_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run redemption workers that process jobs queued by the bot.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    args = parser.parse_args()
+
+    asyncio.run(prepare_db())
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_process, args=(index,), name=f"worker-{index}") for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} redemption worker processes")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Received KeyboardInterrupt, stopping workers...")
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()